@@ -1,20 +1,44 @@
 # Import necessary libraries
 import os
+import re
+import asyncio
+import random
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 # import openai
 # import anthropic
 import fitz  # PyMuPDF
-import pandas as pd
+import csv
 import json
-from tqdm.notebook import tqdm
-from getpass import getpass
+from tqdm.auto import tqdm  # Picks the notebook or terminal progress bar automatically
 import time
-from dataclasses import dataclass
+import hashlib
+import unicodedata
+import sqlite3
+import contextlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, fields, replace
 from typing import Optional
 
+# orjson parses model responses several times faster; fall back to the stdlib if missing
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+# datasketch enables near-duplicate detection (e.g. a preprint and its published version)
+try:
+    from datasketch import MinHash, MinHashLSH
+    DATASKETCH_AVAILABLE = True
+except ImportError:
+    DATASKETCH_AVAILABLE = False
+
 # --- 1. DATA CLASSES ---
 
-@dataclass
+@dataclass(slots=True)
 class StudyIdentification:
     title: Optional[str] = None
     lead_author: Optional[str] = None
@@ -23,14 +47,14 @@ class StudyIdentification:
     doi: Optional[str] = None
     country: Optional[str] = None
 
-@dataclass
+@dataclass(slots=True)
 class StudyCharacteristics:
     study_aim: Optional[str] = None
     study_design: Optional[str] = None
     followup_duration: Optional[str] = None
     multisite_study: Optional[str] = None
 
-@dataclass
+@dataclass(slots=True)
 class Participants:
     clinical_population: Optional[str] = None
     diagnosis: Optional[str] = None
@@ -40,7 +64,7 @@ class Participants:
     control_group: Optional[str] = None
     total_participants: Optional[str] = None
 
-@dataclass
+@dataclass(slots=True)
 class MRIAcquisition:
     field_strength: Optional[str] = None
     manufacturer: Optional[str] = None
@@ -53,7 +77,7 @@ class MRIAcquisition:
     te: Optional[str] = None
     acquisition_time: Optional[str] = None
 
-@dataclass
+@dataclass(slots=True)
 class AnalysisMethods:
     preprocessing: Optional[str] = None
     analysis_software: Optional[str] = None
@@ -63,37 +87,37 @@ class AnalysisMethods:
     tissue_analyzed: Optional[str] = None
     regions_analyzed: Optional[str] = None
 
-@dataclass
+@dataclass(slots=True)
 class StatisticalAnalysis:
     multiple_comparison_correction: Optional[str] = None
 
-@dataclass
+@dataclass(slots=True)
 class FreeWaterResults:
     clinical_group_fw_values: Optional[str] = None
     control_group_fw_values: Optional[str] = None
     group_comparison_p_value: Optional[str] = None
 
-@dataclass
+@dataclass(slots=True)
 class Associations:
     clinical_measure_associations: Optional[str] = None
     measure_name: Optional[str] = None
     association_type: Optional[str] = None
     association_statistics: Optional[str] = None
 
-@dataclass
+@dataclass(slots=True)
 class Biomarkers:
     biomarker_measured: Optional[str] = None
     biomarker_details: Optional[str] = None
     biomarker_associations: Optional[str] = None
 
-@dataclass
+@dataclass(slots=True)
 class KeyFindings:
     primary_finding: Optional[str] = None
     main_interpretation: Optional[str] = None
     key_limitations: Optional[str] = None
     other_measures: Optional[str] = None
 
-@dataclass
+@dataclass(slots=True)
 class ExtractedData:
     filename: Optional[str] = None
     identification: Optional[StudyIdentification] = None
@@ -116,97 +140,43 @@ class ExtractedData:
             result['error'] = self.error
             return result
             
-        if self.identification:
-            result.update({
-                'title': self.identification.title,
-                'lead_author': self.identification.lead_author,
-                'year': self.identification.year,
-                'journal': self.identification.journal,
-                'doi': self.identification.doi,
-                'country': self.identification.country
-            })
-            
-        if self.characteristics:
-            result.update({
-                'study_aim': self.characteristics.study_aim,
-                'study_design': self.characteristics.study_design,
-                'followup_duration': self.characteristics.followup_duration,
-                'multisite_study': self.characteristics.multisite_study
-            })
-            
-        if self.participants:
-            result.update({
-                'clinical_population': self.participants.clinical_population,
-                'diagnosis': self.participants.diagnosis,
-                'disease_duration': self.participants.disease_duration,
-                'severity_scale': self.participants.severity_scale,
-                'clinical_scores': self.participants.clinical_scores,
-                'control_group': self.participants.control_group,
-                'total_participants': self.participants.total_participants
-            })
-            
-        if self.mri_acquisition:
-            result.update({
-                'field_strength': self.mri_acquisition.field_strength,
-                'manufacturer': self.mri_acquisition.manufacturer,
-                'b_values': self.mri_acquisition.b_values,
-                'num_b_shells': self.mri_acquisition.num_b_shells,
-                'gradient_directions': self.mri_acquisition.gradient_directions,
-                'reverse_phase_encoding': self.mri_acquisition.reverse_phase_encoding,
-                'voxel_size': self.mri_acquisition.voxel_size,
-                'tr': self.mri_acquisition.tr,
-                'te': self.mri_acquisition.te,
-                'acquisition_time': self.mri_acquisition.acquisition_time
-            })
-            
-        if self.analysis_methods:
-            result.update({
-                'preprocessing': self.analysis_methods.preprocessing,
-                'analysis_software': self.analysis_methods.analysis_software,
-                'free_water_method': self.analysis_methods.free_water_method,
-                'free_water_metrics': self.analysis_methods.free_water_metrics,
-                'analysis_approach': self.analysis_methods.analysis_approach,
-                'tissue_analyzed': self.analysis_methods.tissue_analyzed,
-                'regions_analyzed': self.analysis_methods.regions_analyzed
-            })
-            
-        if self.statistical_analysis:
-            result.update({
-                'multiple_comparison_correction': self.statistical_analysis.multiple_comparison_correction
-            })
-            
-        if self.free_water_results:
-            result.update({
-                'clinical_group_fw_values': self.free_water_results.clinical_group_fw_values,
-                'control_group_fw_values': self.free_water_results.control_group_fw_values,
-                'group_comparison_p_value': self.free_water_results.group_comparison_p_value
-            })
-            
-        if self.associations:
-            result.update({
-                'clinical_measure_associations': self.associations.clinical_measure_associations,
-                'measure_name': self.associations.measure_name,
-                'association_type': self.associations.association_type,
-                'association_statistics': self.associations.association_statistics
-            })
-            
-        if self.biomarkers:
-            result.update({
-                'biomarker_measured': self.biomarkers.biomarker_measured,
-                'biomarker_details': self.biomarkers.biomarker_details,
-                'biomarker_associations': self.biomarkers.biomarker_associations
-            })
-            
-        if self.key_findings:
-            result.update({
-                'primary_finding': self.key_findings.primary_finding,
-                'main_interpretation': self.key_findings.main_interpretation,
-                'key_limitations': self.key_findings.key_limitations,
-                'other_measures': self.key_findings.other_measures
-            })
-            
+        for section_name, field_names in SECTION_FIELDS:
+            section = getattr(self, section_name)
+            if section:
+                for name in field_names:
+                    result[name] = getattr(section, name)
+
         return result
 
+# (ExtractedData attribute, its section's field names) for every section, in CSV column order
+SECTION_FIELDS = [
+    (section_name, tuple(field.name for field in fields(section_class)))
+    for section_name, section_class in (
+        ('identification', StudyIdentification),
+        ('characteristics', StudyCharacteristics),
+        ('participants', Participants),
+        ('mri_acquisition', MRIAcquisition),
+        ('analysis_methods', AnalysisMethods),
+        ('statistical_analysis', StatisticalAnalysis),
+        ('free_water_results', FreeWaterResults),
+        ('associations', Associations),
+        ('biomarkers', Biomarkers),
+        ('key_findings', KeyFindings),
+    )
+]
+
+# Full, fixed CSV header so rows can be streamed to disk as each paper finishes
+EXTRACTION_FIELDS = [name for _, field_names in SECTION_FIELDS for name in field_names]
+
+CSV_FIELDNAMES = ['filename'] + EXTRACTION_FIELDS + ['error']
+
+# JSON schema the model's output must follow: one string per extracted field
+RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {name: {"type": "STRING"} for name in EXTRACTION_FIELDS},
+    "required": EXTRACTION_FIELDS,
+}
+
 # --- 2. CONFIGURATION ---
 
 # Choose the AI model. For this complex task, 'gemini' (with Pro) or 'claude' (with Sonnet/Opus) is recommended.
@@ -231,33 +201,108 @@ PDF_FOLDER = r'/home/uqahonne/uq/FW_systematic_review/systematic_review/PDFs_onl
 # The name of the final spreadsheet file.
 OUTPUT_CSV = 'test2_extraction_gemini_summary_subset_5.csv'
 
+# Gemini model used for extraction. Flash is much cheaper and faster than Pro and is
+# sufficient for filling a fixed schema.
+GEMINI_MODEL = 'gemini-1.5-flash-latest'
+
+# Structured output: the model must return JSON matching RESPONSE_SCHEMA
+GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": RESPONSE_SCHEMA,
+}
+
+# --- Batch mode ---
+# Submit every PDF as a single Gemini Batch API job instead of one request per file.
+# Batch jobs are billed at half the normal token price and are not subject to the
+# per-minute request limits, but can take several hours to finish.
+# Requires the google-genai package: pip install google-genai
+USE_BATCH_API = False
+BATCH_REQUESTS_PATH = 'batch_requests.jsonl'
+BATCH_POLL_INTERVAL = 30  # Seconds between batch job status checks
+
+# --- Concurrency ---
+# Maximum number of Gemini requests in flight at once, and the requests-per-minute
+# quota of your Gemini tier. Both can be overridden with environment variables.
+GEMINI_CONCURRENCY = int(os.getenv('GEMINI_CONCURRENCY', '5'))
+GEMINI_RPM = int(os.getenv('GEMINI_RPM', '60'))
+# Worker processes for PDF text extraction. A few are enough to stay ahead of the API.
+PDF_WORKERS = int(os.getenv('PDF_WORKERS', str(min(os.cpu_count() or 1, 4))))
+# Number of PDFs hashed ahead of the one being dispatched. Reading them also pulls them into
+# the OS page cache, so the worker that parses each file reopens it without waiting on the disk.
+PDF_PREFETCH = 8
+
+# --- Retries ---
+# Rate-limit (429) and temporary server (5xx) errors are retried with exponential
+# backoff and jitter; only a failure after the last attempt is written as an error row.
+MAX_API_ATTEMPTS = 6
+RETRY_INITIAL_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+
+# --- Section selection ---
+# Send the first page plus each relevant section, whole (from its heading to the next heading),
+# instead of the whole paper; sections under these headings are left out. Falls back to the
+# full text when no headings are found.
+SECTION_FILTER = True
+SKIPPED_SECTIONS = ('acknowledgements', 'acknowledgments', 'funding', 'conflicts of interest',
+                    'conflict of interest', 'competing interests', 'declaration of competing interest',
+                    'author contributions', 'data availability', 'supplementary material', 'abbreviations')
+
+# --- Input size ---
+# Token budget for one request, kept below the model's context window. Only papers long
+# enough to possibly exceed it are measured with count_tokens and trimmed to fit.
+MAX_INPUT_TOKENS = 900_000
+
+# --- Response cache ---
+# Raw Gemini responses are stored by content hash and prompt fingerprint so reruns over
+# the same papers (even under different filenames) cost no tokens. Delete the file to start fresh.
+USE_RESPONSE_CACHE = True
+RESPONSE_CACHE_PATH = '.gemini_cache.sqlite'
+
+# --- Resume ---
+# Papers already in OUTPUT_CSV are skipped on a rerun. When True, rows that recorded an
+# error are removed first so those papers are attempted again.
+RETRY_FAILED_ON_RESUME = True
+
+# --- Near-duplicate detection ---
+# Papers whose text overlaps at least this much (estimated Jaccard similarity of word
+# 5-grams) reuse the result of the first one instead of being sent again.
+# Requires the optional datasketch package.
+NEAR_DUPLICATE_DETECTION = True
+NEAR_DUPLICATE_THRESHOLD = 0.9
+
 
 # --- 2. API KEY and NEW PROMPT TEMPLATE ---
 
-# Get API key from environment variable or user input
-API_KEY = os.getenv('GEMINI_API_KEY')
+# Get API key from environment variable or user input (see get_api_key)
+API_KEY = None
 
-if not API_KEY:
-    try:
-        API_KEY = getpass(f'Enter your {ANALYSIS_MODEL.title()} API Key: ')
-    except (EOFError, KeyboardInterrupt):
-        # Fallback to direct input if getpass fails
-        API_KEY = input(f'Enter your {ANALYSIS_MODEL.title()} API Key: ')
+def get_api_key():
+    api_key = os.getenv('GEMINI_API_KEY')
 
-if not API_KEY or API_KEY.strip() == "":
-    print("Error: No API key provided. Set GEMINI_API_KEY environment variable or enter when prompted. Exiting.")
-    exit(1)
+    if not api_key:
+        from getpass import getpass
+        try:
+            api_key = getpass(f'Enter your {ANALYSIS_MODEL.title()} API Key: ')
+        except (EOFError, KeyboardInterrupt):
+            # Fallback to direct input if getpass fails
+            api_key = input(f'Enter your {ANALYSIS_MODEL.title()} API Key: ')
+
+    if not api_key or api_key.strip() == "":
+        print("Error: No API key provided. Set GEMINI_API_KEY environment variable or enter when prompted. Exiting.")
+        exit(1)
+
+    return api_key
 
 # --- NEW DETAILED PROMPT ---
-# This prompt is formatted for Gemini, instructing it to return a single JSON object.
-DATA_EXTRACTION_PROMPT = """
+# The static instructions are set once as the model's system instruction (see
+# create_extraction_model), so each prompt carries only the paper text.
+EXTRACTION_INSTRUCTIONS = """
 You are a meticulous research assistant conducting systematic data extraction for a meta-analysis on free water diffusion MRI studies.
 For each paper provided, extract the following information exactly as specified. If information is not available, write "Not reported" or "NR".
+Return a single JSON object using the field names of the response schema, with every value as a string.
 
 **DATA EXTRACTION - PART 1: STUDY & PARTICIPANT DETAILS**
 
-Extract the following information from the provided paper. Write "Not reported" if unavailable.
-
 **STUDY IDENTIFICATION**
 - Title: [Exact title]
 - Lead author: [First author surname, initials]
@@ -283,8 +328,6 @@ Extract the following information from the provided paper. Write "Not reported"
 
 **DATA EXTRACTION - PART 2: MRI PARAMETERS & METHODS**
 
-Extract technical details from the provided paper. Write "Not reported" if unavailable.
-
 **MRI ACQUISITION**
 - Scanner field strength: 1.5T | 3T | 7T
 - Manufacturer: Siemens | GE | Philips | Other [specify]
@@ -308,8 +351,6 @@ Extract technical details from the provided paper. Write "Not reported" if unava
 
 **DATA EXTRACTION - PART 3: RESULTS & FINDINGS**
 
-Extract statistical results and findings from the provided paper. Write "Not reported" if unavailable.
-
 **STATISTICAL ANALYSIS**
 - Multiple comparison correction: Bonferroni | FDR | FWE | None | Other
 
@@ -334,49 +375,575 @@ Extract statistical results and findings from the provided paper. Write "Not rep
 - Main interpretation: [Authors' conclusion]
 - Key limitations: [Main limitations mentioned]
 - Other measures: [ROC AUC, mediation etc. if reported]
+"""
 
+# Per-paper part of the prompt
+DATA_EXTRACTION_PROMPT = """
 Here is the full text of the paper:
 ---
 {pdf_text}
 ---
 """
 
+# Split once so each request is built by concatenation rather than str.format
+_PROMPT_PRE, _PROMPT_POST = DATA_EXTRACTION_PROMPT.split("{pdf_text}")
+
+# Everything besides the paper that shapes the response. Response cache keys include it,
+# so editing the prompt, model, schema or section filter invalidates earlier answers.
+PROMPT_FINGERPRINT = hashlib.sha256(json.dumps(
+    [EXTRACTION_INSTRUCTIONS, DATA_EXTRACTION_PROMPT, GEMINI_MODEL, GENERATION_CONFIG,
+     SECTION_FILTER, SKIPPED_SECTIONS, MAX_INPUT_TOKENS]
+).encode('utf-8')).hexdigest()
+
 # --- 3. HELPER FUNCTIONS ---
 
+# Words split across a line break ("diffu-\nsion"), soft hyphens, runs of spaces and blank lines
+_HYPHEN_BREAK_RE = re.compile(r'(?<=[a-z])-\n(?=[a-z])')
+_SPACES_RE = re.compile(r'[ \t\u00a0]+')
+_BLANK_LINES_RE = re.compile(r'\n(?:[ \t]*\n)+')
+
+def normalize_pdf_text(text):
+    """Fold ligatures and compatibility characters and squeeze out layout whitespace.
+
+    Line breaks and form feeds are kept so section headings can still be found.
+    """
+    text = unicodedata.normalize('NFKC', text).replace('\u00ad', '')
+    text = _HYPHEN_BREAK_RE.sub('', text)
+    text = _SPACES_RE.sub(' ', text)
+    return _BLANK_LINES_RE.sub('\n', text)
+
+# The reference list and anything after it is never needed for extraction
+_REFERENCES_HEADER_RE = re.compile(r'^[ \t]*(?:references|bibliography)[ \t]*$', re.IGNORECASE | re.MULTILINE)
+
+# Pages with less text than this (figures, full-page tables as images) are skipped
+MIN_PAGE_CHARS = 200
+
 def extract_text_from_pdf(pdf_path):
+    """Extract the text of a PDF"""
     try:
-        doc = fitz.open(pdf_path)
-        text = "".join(page.get_text() for page in doc)
-        doc.close()
-        return text, "Success"
+        # Plain text without block sorting or image/ligature handling, with line-end hyphens
+        # joined by MuPDF; pages separated by form feeds
+        parts = []
+        with fitz.open(pdf_path) as doc:
+            for i in range(doc.page_count):
+                page_text = doc.load_page(i).get_text(
+                    "text", sort=False, flags=fitz.TEXT_PRESERVE_WHITESPACE | fitz.TEXT_DEHYPHENATE)
+                references = _REFERENCES_HEADER_RE.search(page_text)
+                if references:
+                    parts.append(page_text[:references.start()])
+                    break
+                # The first page is always kept: it holds the title, authors and DOI
+                if i == 0 or len(page_text.strip()) >= MIN_PAGE_CHARS:
+                    parts.append(page_text)
+        return normalize_pdf_text("\f".join(parts)), "Success"
     except Exception as e:
         return None, f"Error reading PDF: {e}"
 
-def extract_data_with_gemini(text, model):
-    prompt = DATA_EXTRACTION_PROMPT.format(pdf_text=text[:1_500_000])
-    raw_response_text = "" # Initialize variable to hold the raw response
+# Headings of the sections the extraction prompt draws from, optionally numbered ("2.1 Participants")
+_SECTION_HEADER_RE = re.compile(
+    r'^[ \t]*(?:\d+(?:\.\d+)*\.?[ \t]+)?'
+    r'(abstract|introduction|materials and methods|methods?|participants?|subjects?'
+    r'|results|discussion|conclusions?|limitations)\b',
+    re.IGNORECASE | re.MULTILINE
+)
+
+# Headings of the SKIPPED_SECTIONS, which end the relevant section before them
+_SKIPPED_HEADER_RE = re.compile(
+    r'^[ \t]*(?:\d+(?:\.\d+)*\.?[ \t]+)?(?:' + '|'.join(map(re.escape, SKIPPED_SECTIONS)) + r')\b',
+    re.IGNORECASE | re.MULTILINE
+)
+
+def select_relevant_sections(text):
+    """Keep the first page and each relevant section up to the next heading, merging adjacent ones"""
+    relevant_starts = [m.start() for m in _SECTION_HEADER_RE.finditer(text)]
+    if not relevant_starts:
+        return text
+
+    # A section runs to the next heading of either kind, so long Methods sections are kept whole
+    heading_starts = sorted(set(relevant_starts).union(m.start() for m in _SKIPPED_HEADER_RE.finditer(text)))
+    next_heading = dict(zip(heading_starts, heading_starts[1:] + [len(text)]))
+    spans = [(start, next_heading[start]) for start in relevant_starts]
+
+    # Title, authors, journal and DOI live on the first page
+    first_page_end = text.find('\f')
+    spans.append((0, first_page_end if first_page_end != -1 else len(text)))
+    spans.sort()
+
+    merged = [list(spans[0])]
+    for start, end in spans[1:]:
+        if start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return "\n...\n".join(text[start:end] for start, end in merged)
+
+def prepare_paper_text(text):
+    """Reduce the extracted PDF text to what is sent to Gemini"""
+    if SECTION_FILTER:
+        text = select_relevant_sections(text)
+    # Hard ceiling at ~4 characters per token; fit_to_token_budget trims by counted tokens
+    return text[:MAX_INPUT_TOKENS * 4]
+
+class TokenBucket:
+    """Token-bucket rate limiter: up to `capacity` requests at once, refilled at `refill_per_sec`.
+
+    Each rate-limit (429) response halves the refill rate, down to one request per minute.
+    Every RECOVERY_SUCCESSES successful requests since then double it again, up to the
+    configured rate, so an early burst of 429s does not slow the rest of the run.
+    """
+
+    RECOVERY_SUCCESSES = 20
+
+    def __init__(self, capacity, refill_per_sec):
+        self.capacity = capacity
+        self.refill_per_sec = refill_per_sec
+        self.max_refill_per_sec = refill_per_sec
+        self._tokens = float(capacity)
+        self._updated = None
+        self._successes = 0
+
+    def _refill(self, now):
+        if self._updated is not None:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.refill_per_sec)
+        self._updated = now
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._refill(loop.time())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.refill_per_sec)
+
+    def throttle(self):
+        self.refill_per_sec = max(self.refill_per_sec / 2, 1 / 60)
+        self._successes = 0
+
+    def record_success(self):
+        if self.refill_per_sec >= self.max_refill_per_sec:
+            return
+        self._successes += 1
+        if self._successes >= self.RECOVERY_SUCCESSES:
+            self.refill_per_sec = min(self.refill_per_sec * 2, self.max_refill_per_sec)
+            self._successes = 0
+
+class ResponseCache:
+    """Persistent map of content hash -> raw Gemini response text, backed by SQLite"""
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL)")
+
+    def get(self, key):
+        row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, response):
+        with self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO responses (key, response) VALUES (?, ?)", (key, response))
+
+    def close(self):
+        self._conn.close()
+
+def response_cache_key(kind, digest):
+    """Cache key for a paper digest ('pdf' bytes or sent 'text') under the current prompt"""
+    return f"{kind}:{digest}:{PROMPT_FINGERPRINT}"
+
+def hash_pdf(path):
+    """Return the SHA-256 of a PDF and an error message (None on success), reading it in chunks"""
+    digest = hashlib.sha256()
     try:
-        response = model.generate_content(prompt, request_options={"timeout": 120})
-        # Immediately store the raw text in case of an error
-        raw_response_text = response.text if hasattr(response, 'text') else ""
-        
-        if not raw_response_text:
-            return ExtractedData(error="The API returned an empty response, possibly due to a safety filter.")
-            
-        # Try to parse as JSON first
+        with open(path, 'rb') as f:
+            while chunk := f.read(1 << 20):
+                digest.update(chunk)
+    except OSError as e:
+        # e.g. no permission, or the file was removed after the folder scan
+        return None, f"Error reading PDF: {e}"
+    return digest.hexdigest(), None
+
+async def prefetch_pdfs(filenames, io_pool, depth):
+    """Yield (filename, sha256, error) in order while up to `depth` later files are hashed in threads"""
+    loop = asyncio.get_running_loop()
+    reads = deque()
+    for filename in filenames:
+        reads.append((filename, loop.run_in_executor(io_pool, hash_pdf, os.path.join(PDF_FOLDER, filename))))
+        if len(reads) >= depth:
+            filename, read = reads.popleft()
+            yield (filename, *await read)
+    while reads:
+        filename, read = reads.popleft()
+        yield (filename, *await read)
+
+RETRYABLE_API_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+)
+
+async def generate_with_retry(model, prompt, rate_limiter=None):
+    """Call Gemini, retrying transient errors with exponential backoff and jitter"""
+    for attempt in range(MAX_API_ATTEMPTS):
+        if rate_limiter:
+            await rate_limiter.acquire()
         try:
-            cleaned_response_text = raw_response_text.strip().lstrip('```json').rstrip('```')
-            json_data = json.loads(cleaned_response_text)
-            return parse_json_response(json_data)
-        except json.JSONDecodeError:
-            # If JSON parsing fails, parse the structured text response
-            return parse_structured_response(raw_response_text)
+            response = await model.generate_content_async(prompt, request_options={"timeout": 120})
+        except RETRYABLE_API_ERRORS as e:
+            if rate_limiter and isinstance(e, google_exceptions.ResourceExhausted):
+                rate_limiter.throttle()
+            if attempt == MAX_API_ATTEMPTS - 1:
+                raise
+            delay = min(RETRY_MAX_DELAY, RETRY_INITIAL_DELAY * 2 ** attempt)
+            await asyncio.sleep(delay + random.uniform(0, delay))
+            continue
+        if rate_limiter:
+            rate_limiter.record_success()
+        return response
+
+class NearDuplicateIndex:
+    """MinHash LSH index from paper text to the task extracting it"""
+
+    def __init__(self, threshold, num_perm=128):
+        self._lsh = MinHashLSH(threshold=threshold, num_perm=num_perm)
+        self._num_perm = num_perm
+        self._tasks = {}
+        self.matches = 0
+
+    def _minhash(self, text):
+        words = text.lower().split()
+        shingles = {' '.join(words[i:i + 5]).encode('utf-8') for i in range(max(len(words) - 4, 1))}
+        minhash = MinHash(num_perm=self._num_perm)
+        minhash.update_batch(list(shingles))
+        return minhash
+
+    def find_or_add(self, key, text, task):
+        """Return the task of an already indexed near-duplicate, or index this text under `task`"""
+        minhash = self._minhash(text)
+        matches = self._lsh.query(minhash)
+        if matches:
+            self.matches += 1
+            return self._tasks[matches[0]]
+        self._lsh.insert(key, minhash)
+        self._tasks[key] = task
+        return None
+
+async def fit_to_token_budget(model, text):
+    """Trim the paper text so the whole prompt stays under MAX_INPUT_TOKENS"""
+    # Fewer than 2 characters per token does not happen in practice, so short papers are never counted
+    if len(text) <= MAX_INPUT_TOKENS * 2:
+        return text
+    counted = await model.count_tokens_async([_PROMPT_PRE, text, _PROMPT_POST])
+    if counted.total_tokens <= MAX_INPUT_TOKENS:
+        return text
+
+    # Binary search for the longest prefix that fits, to within 4096 characters
+    low, high = 0, len(text)
+    while high - low > 4096:
+        middle = (low + high) // 2
+        counted = await model.count_tokens_async([_PROMPT_PRE, text[:middle], _PROMPT_POST])
+        if counted.total_tokens <= MAX_INPUT_TOKENS:
+            low = middle
+        else:
+            high = middle
+    return text[:low]
+
+async def extract_data_with_gemini(text, model, cache=None, pdf_digest=None, rate_limiter=None):
+    paper_text = prepare_paper_text(text)
+    text_key = response_cache_key('text', hashlib.sha256(paper_text.encode('utf-8')).hexdigest())
+    raw_response_text = "" # Initialize variable to hold the raw response
+    try:
+        # A cached answer that no longer parses (e.g. stored by an older version) is requested again
+        cached_response = cache.get(text_key) if cache else None
+        extracted_data = parse_response_text(cached_response) if cached_response is not None else None
+        if extracted_data is None or extracted_data.error:
+            paper_text = await fit_to_token_budget(model, paper_text)
+            # Sent as three parts of one message, so the paper text is never copied into a new string
+            prompt = [_PROMPT_PRE, paper_text, _PROMPT_POST]
+            response = await generate_with_retry(model, prompt, rate_limiter)
+            # Immediately store the raw text in case of an error
+            raw_response_text = response.text if hasattr(response, 'text') else ""
+            extracted_data = parse_response_text(raw_response_text)
+        else:
+            raw_response_text = cached_response
+
+        # Only answers that parsed cleanly are cached, so a truncated or garbled one is retried next run
+        if cache and not extracted_data.error:
+            cache.set(text_key, raw_response_text)
+            if pdf_digest:
+                cache.set(response_cache_key('pdf', pdf_digest), raw_response_text)
+        return extracted_data
         
     except Exception as e:
         return ExtractedData(error=f"An unexpected API error occurred: {e}")
 
+def parse_response_text(raw_response_text):
+    """Parse the raw model output as JSON, falling back to structured text if it is not valid JSON"""
+    if not raw_response_text:
+        return ExtractedData(error="The API returned an empty response, possibly due to a safety filter.")
+        
+    # JSON mode normally returns a bare JSON object
+    try:
+        return parse_json_response(json_loads(raw_response_text))
+    except json.JSONDecodeError:
+        pass
+
+    # Strip a Markdown code fence if present (removeprefix, not lstrip, which strips a character set)
+    cleaned_response_text = raw_response_text.strip()
+    cleaned_response_text = cleaned_response_text.removeprefix('```json').removeprefix('```').removesuffix('```').strip()
+    try:
+        return parse_json_response(json_loads(cleaned_response_text))
+    except json.JSONDecodeError:
+        # Not JSON at all: parse the "- Field: Value" text format
+        return parse_structured_response(raw_response_text)
+
+class CsvResultWriter:
+    """Appends each result to the output CSV as soon as it is available, so an interrupted run keeps its progress"""
+
+    def __init__(self, f):
+        self._file = f
+        self._writer = csv.DictWriter(f, fieldnames=CSV_FIELDNAMES)
+        if f.tell() == 0:
+            self._writer.writeheader()
+        self.rows_written = 0
+        self.error_count = 0
+
+    def write(self, result):
+        self._writer.writerow(result.to_dict())
+        self._file.flush()
+        self.rows_written += 1
+        if result.error:
+            self.error_count += 1
+
+def load_completed_filenames(csv_path, drop_errors=False):
+    """
+    Return the header and filenames of an existing output CSV from an earlier (possibly interrupted) run.
+    With drop_errors, rows recording a failure are removed from the file so those papers are retried.
+    """
+    if not os.path.exists(csv_path) or os.path.getsize(csv_path) == 0:
+        return None, set()
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        rows = list(reader)
+        fieldnames = reader.fieldnames
+
+    # Only a file in the current format is rewritten; a mismatched one is rejected by the caller
+    if drop_errors and fieldnames == CSV_FIELDNAMES:
+        kept_rows = [row for row in rows if not row.get('error')]
+        if len(kept_rows) < len(rows):
+            temp_path = csv_path + '.tmp'
+            with open(temp_path, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, fieldnames=fieldnames)
+                writer.writeheader()
+                writer.writerows(kept_rows)
+            os.replace(temp_path, csv_path)
+            print(f"Removed {len(rows) - len(kept_rows)} failed row(s) from '{csv_path}'; they will be retried.")
+            rows = kept_rows
+
+    return fieldnames, {row['filename'] for row in rows if row.get('filename')}
+
+async def process_file(filename, pdf_future, pdf_digest, model, semaphore, rate_limiter, result_writer, cache,
+                       near_duplicates=None):
+    """Wait for the PDF text from the process pool, send it to Gemini and write the result"""
+    try:
+        pdf_text, status = await asyncio.wrap_future(pdf_future)
+    except Exception as e:
+        # The worker process died (e.g. MuPDF crashed on a malformed PDF, or ran out of memory)
+        pdf_text, status = None, f"Error reading PDF: extraction worker failed ({e})"
+    if not pdf_text:
+        error_data = ExtractedData(filename=filename, error=status)
+        result_writer.write(error_data)
+        return error_data
+
+    # A near-identical paper already being extracted is reused instead of sent again. Its identification
+    # fields (title, authors, year, journal, DOI) are left blank: a preprint and its published version
+    # share the study data but not those, and a blank row shows the reviewer what still needs filling in
+    if near_duplicates is not None:
+        original_task = near_duplicates.find_or_add(filename, pdf_text, asyncio.current_task())
+        if original_task is not None:
+            original = await original_task
+            extracted_data = replace(original, filename=filename, identification=None)
+            result_writer.write(extracted_data)
+            return extracted_data
+
+    async with semaphore:
+        extracted_data = await extract_data_with_gemini(pdf_text, model, cache, pdf_digest, rate_limiter)
+    extracted_data.filename = filename # Add filename for reference
+    result_writer.write(extracted_data)
+    return extracted_data
+
+async def copy_duplicate_result(filename, original_task, result_writer):
+    """Reuse the result of an identical PDF listed under another filename"""
+    original = await original_task
+    result_writer.write(replace(original, filename=filename))
+
+def filter_existing_pdfs(files_to_process):
+    """Drop listed files that are not in PDF_FOLDER, using one directory scan instead of a stat per file"""
+    with os.scandir(PDF_FOLDER) as entries:
+        existing = {entry.name for entry in entries if entry.is_file()}
+    missing = [f for f in files_to_process if f not in existing]
+    if missing:
+        print(f"Warning: {len(missing)} file(s) not found in '{PDF_FOLDER}', skipping: {', '.join(missing)}")
+    return [f for f in files_to_process if f in existing]
+
+async def run_extraction(files_to_process, model, result_writer, cache=None):
+    """Process all PDFs concurrently, writing each result as soon as it completes"""
+    semaphore = asyncio.Semaphore(GEMINI_CONCURRENCY)
+    rate_limiter = TokenBucket(GEMINI_CONCURRENCY, GEMINI_RPM / 60)
+    near_duplicates = None
+    if NEAR_DUPLICATE_DETECTION and DATASKETCH_AVAILABLE:
+        near_duplicates = NearDuplicateIndex(NEAR_DUPLICATE_THRESHOLD)
+
+    # PDF parsing is CPU-bound, so it runs in worker processes and overlaps with in-flight API calls.
+    # Files are hashed by a small thread pool ahead of dispatch, so disk reads overlap as well.
+    with contextlib.ExitStack() as stack:
+        pool = stack.enter_context(ProcessPoolExecutor(max_workers=PDF_WORKERS))
+        io_pool = stack.enter_context(ThreadPoolExecutor(max_workers=PDF_PREFETCH))
+        tasks = []
+        tasks_by_digest = {}
+        cache_hits = 0
+        duplicates = 0
+        async for filename, pdf_digest, read_error in prefetch_pdfs(files_to_process, io_pool, PDF_PREFETCH):
+            if read_error:
+                result_writer.write(ExtractedData(filename=filename, error=read_error))
+                continue
+
+            # The same PDF listed twice (or under another name) is only sent once
+            if pdf_digest in tasks_by_digest:
+                tasks.append(asyncio.create_task(
+                    copy_duplicate_result(filename, tasks_by_digest[pdf_digest], result_writer)))
+                duplicates += 1
+                continue
+
+            # A PDF seen in an earlier run is answered from the cache without parsing it; a cached
+            # answer that no longer parses is ignored and the paper is sent again
+            cached_response = cache.get(response_cache_key('pdf', pdf_digest)) if cache else None
+            if cached_response is not None:
+                try:
+                    extracted_data = parse_response_text(cached_response)
+                except Exception as e:
+                    extracted_data = ExtractedData(error=f"Could not parse cached response: {e}")
+                if not extracted_data.error:
+                    extracted_data.filename = filename
+                    result_writer.write(extracted_data)
+                    cache_hits += 1
+                    continue
+
+            # The worker reopens the file, which the hashing read has just pulled into the OS page cache
+            pdf_path = os.path.join(PDF_FOLDER, filename)
+            try:
+                pdf_future = pool.submit(extract_text_from_pdf, pdf_path)
+            except BrokenProcessPool:
+                # A worker crash breaks the whole pool; files still in it fail, the rest go to a new one
+                pool = stack.enter_context(ProcessPoolExecutor(max_workers=PDF_WORKERS))
+                pdf_future = pool.submit(extract_text_from_pdf, pdf_path)
+            task = asyncio.create_task(
+                process_file(filename, pdf_future, pdf_digest, model, semaphore, rate_limiter, result_writer, cache,
+                             near_duplicates))
+            tasks_by_digest[pdf_digest] = task
+            tasks.append(task)
+
+        if cache_hits:
+            print(f"{cache_hits} file(s) answered from the response cache.")
+        if duplicates:
+            print(f"{duplicates} duplicate file(s) will reuse the result of an identical PDF.")
+
+        with tqdm(total=len(tasks), desc="Extracting Data") as progress:
+            for task in tasks:
+                task.add_done_callback(lambda _: progress.update(1))
+            await asyncio.gather(*tasks)
+
+        if near_duplicates is not None and near_duplicates.matches:
+            print(f"{near_duplicates.matches} near-duplicate file(s) reused the result of a similar paper; "
+                  "their identification fields are left blank.")
+
+def run_batch_extraction(files_to_process):
+    """
+    Package every PDF prompt into one JSONL file, submit it as a single Gemini
+    Batch API job, wait for it to finish and map the results back to filenames.
+    """
+    try:
+        from google import genai as google_genai
+    except ImportError:
+        print("Error: Batch mode requires the google-genai package (pip install google-genai).")
+        return []
+
+    client = google_genai.Client(api_key=API_KEY)
+    all_results = []
+    submitted = []
+
+    # Build one request line per PDF, keyed by filename
+    with open(BATCH_REQUESTS_PATH, 'w', encoding='utf-8') as f:
+        for filename in tqdm(files_to_process, desc="Preparing Batch Requests"):
+            pdf_text, status = extract_text_from_pdf(os.path.join(PDF_FOLDER, filename))
+            if not pdf_text:
+                all_results.append(ExtractedData(filename=filename, error=status))
+                continue
+
+            paper_text = prepare_paper_text(pdf_text)
+            request = {
+                "system_instruction": {"parts": [{"text": EXTRACTION_INSTRUCTIONS}]},
+                "contents": [{"parts": [{"text": _PROMPT_PRE}, {"text": paper_text}, {"text": _PROMPT_POST}]}],
+                "generation_config": GENERATION_CONFIG
+            }
+            f.write(json.dumps({"key": filename, "request": request}) + "\n")
+            submitted.append(filename)
+
+    if not submitted:
+        return all_results
+
+    uploaded = client.files.upload(
+        file=BATCH_REQUESTS_PATH,
+        config={"display_name": "fw-data-extraction-requests", "mime_type": "jsonl"}
+    )
+    job = client.batches.create(
+        model=GEMINI_MODEL,
+        src=uploaded.name,
+        config={"display_name": "fw-data-extraction"}
+    )
+    print(f"Submitted batch job '{job.name}' with {len(submitted)} request(s). Waiting for completion...")
+
+    done_states = {'JOB_STATE_SUCCEEDED', 'JOB_STATE_FAILED', 'JOB_STATE_CANCELLED', 'JOB_STATE_EXPIRED'}
+    while job.state.name not in done_states:
+        time.sleep(BATCH_POLL_INTERVAL)
+        job = client.batches.get(name=job.name)
+        print(f"Batch job state: {job.state.name}")
+
+    if job.state.name != 'JOB_STATE_SUCCEEDED':
+        error = f"Batch job ended with state {job.state.name}"
+        all_results.extend(ExtractedData(filename=filename, error=error) for filename in submitted)
+        return all_results
+
+    result_lines = client.files.download(file=job.dest.file_name).decode('utf-8').splitlines()
+    returned = set()
+    for line in result_lines:
+        if not line.strip():
+            continue
+        row = json.loads(line)
+        filename = row.get('key')
+        response = row.get('response')
+        if response:
+            candidates = response.get('candidates') or [{}]
+            parts = candidates[0].get('content', {}).get('parts', [])
+            extracted_data = parse_response_text("".join(part.get('text', '') for part in parts))
+        else:
+            extracted_data = ExtractedData(error=f"Batch request failed: {row.get('error')}")
+        extracted_data.filename = filename
+        all_results.append(extracted_data)
+        returned.add(filename)
+
+    # Any request without a result line is reported rather than silently dropped
+    for filename in submitted:
+        if filename not in returned:
+            all_results.append(ExtractedData(filename=filename, error="No result returned by batch job"))
+
+    return all_results
+
 def parse_json_response(json_data):
     """Parse JSON response into structured data classes"""
+    if not isinstance(json_data, dict):
+        return ExtractedData(error=f"Expected a JSON object from the API, got {type(json_data).__name__}")
+
     identification = StudyIdentification()
     characteristics = StudyCharacteristics()
     participants = Participants()
@@ -388,31 +955,24 @@ def parse_json_response(json_data):
     biomarkers = Biomarkers()
     key_findings = KeyFindings()
     
+    targets = {
+        'identification': identification,
+        'characteristics': characteristics,
+        'participants': participants,
+        'mri_acquisition': mri_acquisition,
+        'analysis_methods': analysis_methods,
+        'statistical_analysis': statistical_analysis,
+        'free_water_results': free_water_results,
+        'associations': associations,
+        'biomarkers': biomarkers,
+        'key_findings': key_findings
+    }
+    
     # Map JSON fields to data class fields
     for key, value in json_data.items():
-        if key in ['title', 'lead_author', 'year', 'journal', 'doi', 'country']:
-            setattr(identification, key, value)
-        elif key in ['study_aim', 'study_design', 'followup_duration', 'multisite_study']:
-            setattr(characteristics, key, value)
-        elif key in ['clinical_population', 'diagnosis', 'disease_duration', 'severity_scale', 
-                    'clinical_scores', 'control_group', 'total_participants']:
-            setattr(participants, key, value)
-        elif key in ['field_strength', 'manufacturer', 'b_values', 'num_b_shells', 'gradient_directions',
-                    'reverse_phase_encoding', 'voxel_size', 'tr', 'te', 'acquisition_time']:
-            setattr(mri_acquisition, key, value)
-        elif key in ['preprocessing', 'analysis_software', 'free_water_method', 'free_water_metrics',
-                    'analysis_approach', 'tissue_analyzed', 'regions_analyzed']:
-            setattr(analysis_methods, key, value)
-        elif key in ['multiple_comparison_correction']:
-            setattr(statistical_analysis, key, value)
-        elif key in ['clinical_group_fw_values', 'control_group_fw_values', 'group_comparison_p_value']:
-            setattr(free_water_results, key, value)
-        elif key in ['clinical_measure_associations', 'measure_name', 'association_type', 'association_statistics']:
-            setattr(associations, key, value)
-        elif key in ['biomarker_measured', 'biomarker_details', 'biomarker_associations']:
-            setattr(biomarkers, key, value)
-        elif key in ['primary_finding', 'main_interpretation', 'key_limitations', 'other_measures']:
-            setattr(key_findings, key, value)
+        target = JSON_FIELD_MAP.get(key)
+        if target:
+            setattr(targets[target[0]], target[1], value)
     
     return ExtractedData(
         identification=identification,
@@ -427,6 +987,89 @@ def parse_json_response(json_data):
         key_findings=key_findings
     )
 
+# Maps the field labels used in the prompt (and common variants) to (data class, attribute)
+FIELD_MAP = {
+    # Part 1 - Study Identification
+    'Title': ('identification', 'title'),
+    'Lead author': ('identification', 'lead_author'),
+    'Year': ('identification', 'year'),
+    'Year of publication': ('identification', 'year'),
+    'Journal': ('identification', 'journal'),
+    'Journal name': ('identification', 'journal'),
+    'DOI': ('identification', 'doi'),
+    'Country': ('identification', 'country'),
+    # Part 1 - Study Characteristics
+    'Aim': ('characteristics', 'study_aim'),
+    'Aim of study': ('characteristics', 'study_aim'),
+    'Study design': ('characteristics', 'study_design'),
+    'Follow-up duration': ('characteristics', 'followup_duration'),
+    'Multi-site study': ('characteristics', 'multisite_study'),
+    # Part 1 - Participants
+    'Clinical population': ('participants', 'clinical_population'),
+    'Diagnosis': ('participants', 'diagnosis'),
+    'Clinical population diagnosis': ('participants', 'diagnosis'),
+    'Disease duration': ('participants', 'disease_duration'),
+    'Severity scale used': ('participants', 'severity_scale'),
+    'Disease severity scale/assessment used': ('participants', 'severity_scale'),
+    'Clinical scores': ('participants', 'clinical_scores'),
+    'Disease severity/Clinical scores': ('participants', 'clinical_scores'),
+    'Control group': ('participants', 'control_group'),
+    'Total N': ('participants', 'total_participants'),
+    'Total number of participants': ('participants', 'total_participants'),
+    # Part 2 - MRI Acquisition
+    'Scanner field strength': ('mri_acquisition', 'field_strength'),
+    'Manufacturer': ('mri_acquisition', 'manufacturer'),
+    'b-values': ('mri_acquisition', 'b_values'),
+    'Number of b-shells': ('mri_acquisition', 'num_b_shells'),
+    'Gradient directions': ('mri_acquisition', 'gradient_directions'),
+    'Reverse phase-encoding': ('mri_acquisition', 'reverse_phase_encoding'),
+    'Voxel size': ('mri_acquisition', 'voxel_size'),
+    'TR': ('mri_acquisition', 'tr'),
+    'TE': ('mri_acquisition', 'te'),
+    'Acquisition time': ('mri_acquisition', 'acquisition_time'),
+    # Part 2 - Analysis Methods
+    'Preprocessing': ('analysis_methods', 'preprocessing'),
+    'Analysis software': ('analysis_methods', 'analysis_software'),
+    'Free-water method': ('analysis_methods', 'free_water_method'),
+    'Free-water metrics': ('analysis_methods', 'free_water_metrics'),
+    'Analysis approach': ('analysis_methods', 'analysis_approach'),
+    'Tissue analyzed': ('analysis_methods', 'tissue_analyzed'),
+    'Regions analyzed': ('analysis_methods', 'regions_analyzed'),
+    # Part 3 - Statistical Analysis
+    'Multiple comparison correction': ('statistical_analysis', 'multiple_comparison_correction'),
+    # Part 3 - Free Water Results
+    'Clinical group FW values': ('free_water_results', 'clinical_group_fw_values'),
+    'Control group FW values': ('free_water_results', 'control_group_fw_values'),
+    'Group comparison p-value': ('free_water_results', 'group_comparison_p_value'),
+    # Part 3 - Associations
+    'Clinical measure associations': ('associations', 'clinical_measure_associations'),
+    'Measure name': ('associations', 'measure_name'),
+    'Association type': ('associations', 'association_type'),
+    'Association statistics': ('associations', 'association_statistics'),
+    # Part 3 - Biomarkers
+    'Biomarker measured': ('biomarkers', 'biomarker_measured'),
+    'Biomarker details': ('biomarkers', 'biomarker_details'),
+    'Biomarker associations': ('biomarkers', 'biomarker_associations'),
+    # Part 3 - Key Findings
+    'Primary finding': ('key_findings', 'primary_finding'),
+    'Main interpretation': ('key_findings', 'main_interpretation'),
+    'Key limitations': ('key_findings', 'key_limitations'),
+    'Other measures': ('key_findings', 'other_measures'),
+}
+
+# JSON responses use the attribute names themselves as keys
+JSON_FIELD_MAP = {attr: (section, attr) for section, attr in FIELD_MAP.values()}
+
+def canonical_label(label):
+    """Case- and spacing-insensitive form of a field label, so 'lead  Author' matches 'Lead author'"""
+    return " ".join(label.split()).casefold()
+
+# FIELD_MAP keyed by canonical label, for lookups from model output
+CANONICAL_FIELD_MAP = {canonical_label(label): target for label, target in FIELD_MAP.items()}
+
+# Matches "- Field: Value" lines anywhere in the response
+_FIELD_LINE_RE = re.compile(r'^[ \t]*- ([^:\n]+): (.+)$', re.MULTILINE)
+
 def parse_structured_response(text):
     """Parse structured text response into data classes"""
     identification = StudyIdentification()
@@ -439,127 +1082,30 @@ def parse_structured_response(text):
     associations = Associations()
     biomarkers = Biomarkers()
     key_findings = KeyFindings()
+    targets = {
+        'identification': identification,
+        'characteristics': characteristics,
+        'participants': participants,
+        'mri_acquisition': mri_acquisition,
+        'analysis_methods': analysis_methods,
+        'statistical_analysis': statistical_analysis,
+        'free_water_results': free_water_results,
+        'associations': associations,
+        'biomarkers': biomarkers,
+        'key_findings': key_findings
+    }
     
-    # Split text into lines and process
-    lines = text.strip().split('\n')
+    # One pass over the response for lines with format "- Field: Value"
+    fields_found = 0
+    for match in _FIELD_LINE_RE.finditer(text):
+        target = CANONICAL_FIELD_MAP.get(canonical_label(match.group(1)))
+        if target:
+            setattr(targets[target[0]], target[1], match.group(2).strip())
+            fields_found += 1
     
-    for line in lines:
-        line = line.strip()
-        if not line or line.startswith('**') or line.startswith('---'):
-            continue
-            
-        # Look for lines with format "- Field: Value"
-        if line.startswith('- ') and ': ' in line:
-            field_part, value_part = line[2:].split(': ', 1)
-            field_name = field_part.strip()
-            value = value_part.strip()
-            
-            # Map to appropriate data class - Part 1
-            if field_name == 'Title':
-                identification.title = value
-            elif field_name == 'Lead author':
-                identification.lead_author = value
-            elif field_name in ['Year', 'Year of publication']:
-                identification.year = value
-            elif field_name in ['Journal', 'Journal name']:
-                identification.journal = value
-            elif field_name == 'DOI':
-                identification.doi = value
-            elif field_name == 'Country':
-                identification.country = value
-            elif field_name in ['Aim', 'Aim of study']:
-                characteristics.study_aim = value
-            elif field_name == 'Study design':
-                characteristics.study_design = value
-            elif field_name == 'Follow-up duration':
-                characteristics.followup_duration = value
-            elif field_name == 'Multi-site study':
-                characteristics.multisite_study = value
-            elif field_name == 'Clinical population':
-                participants.clinical_population = value
-            elif field_name in ['Diagnosis', 'Clinical population diagnosis']:
-                participants.diagnosis = value
-            elif field_name == 'Disease duration':
-                participants.disease_duration = value
-            elif field_name in ['Severity scale used', 'Disease severity scale/assessment used']:
-                participants.severity_scale = value
-            elif field_name in ['Clinical scores', 'Disease severity/Clinical scores']:
-                participants.clinical_scores = value
-            elif field_name == 'Control group':
-                participants.control_group = value
-            elif field_name in ['Total N', 'Total number of participants']:
-                participants.total_participants = value
-            # Part 2 - MRI Acquisition
-            elif field_name == 'Scanner field strength':
-                mri_acquisition.field_strength = value
-            elif field_name == 'Manufacturer':
-                mri_acquisition.manufacturer = value
-            elif field_name == 'b-values':
-                mri_acquisition.b_values = value
-            elif field_name == 'Number of b-shells':
-                mri_acquisition.num_b_shells = value
-            elif field_name == 'Gradient directions':
-                mri_acquisition.gradient_directions = value
-            elif field_name == 'Reverse phase-encoding':
-                mri_acquisition.reverse_phase_encoding = value
-            elif field_name == 'Voxel size':
-                mri_acquisition.voxel_size = value
-            elif field_name == 'TR':
-                mri_acquisition.tr = value
-            elif field_name == 'TE':
-                mri_acquisition.te = value
-            elif field_name == 'Acquisition time':
-                mri_acquisition.acquisition_time = value
-            # Part 2 - Analysis Methods
-            elif field_name == 'Preprocessing':
-                analysis_methods.preprocessing = value
-            elif field_name == 'Analysis software':
-                analysis_methods.analysis_software = value
-            elif field_name == 'Free-water method':
-                analysis_methods.free_water_method = value
-            elif field_name == 'Free-water metrics':
-                analysis_methods.free_water_metrics = value
-            elif field_name == 'Analysis approach':
-                analysis_methods.analysis_approach = value
-            elif field_name == 'Tissue analyzed':
-                analysis_methods.tissue_analyzed = value
-            elif field_name == 'Regions analyzed':
-                analysis_methods.regions_analyzed = value
-            # Part 3 - Statistical Analysis
-            elif field_name == 'Multiple comparison correction':
-                statistical_analysis.multiple_comparison_correction = value
-            # Part 3 - Free Water Results
-            elif field_name == 'Clinical group FW values':
-                free_water_results.clinical_group_fw_values = value
-            elif field_name == 'Control group FW values':
-                free_water_results.control_group_fw_values = value
-            elif field_name == 'Group comparison p-value':
-                free_water_results.group_comparison_p_value = value
-            # Part 3 - Associations
-            elif field_name == 'Clinical measure associations':
-                associations.clinical_measure_associations = value
-            elif field_name == 'Measure name':
-                associations.measure_name = value
-            elif field_name == 'Association type':
-                associations.association_type = value
-            elif field_name == 'Association statistics':
-                associations.association_statistics = value
-            # Part 3 - Biomarkers
-            elif field_name == 'Biomarker measured':
-                biomarkers.biomarker_measured = value
-            elif field_name == 'Biomarker details':
-                biomarkers.biomarker_details = value
-            elif field_name == 'Biomarker associations':
-                biomarkers.biomarker_associations = value
-            # Part 3 - Key Findings
-            elif field_name == 'Primary finding':
-                key_findings.primary_finding = value
-            elif field_name == 'Main interpretation':
-                key_findings.main_interpretation = value
-            elif field_name == 'Key limitations':
-                key_findings.key_limitations = value
-            elif field_name == 'Other measures':
-                key_findings.other_measures = value
+    # Neither JSON nor the text format (e.g. a truncated JSON answer): report it rather than an empty row
+    if not fields_found:
+        return ExtractedData(error="Could not parse the API response as JSON or structured text.")
     
     return ExtractedData(
         identification=identification,
@@ -574,63 +1120,72 @@ def parse_structured_response(text):
         key_findings=key_findings
     )
 
+def create_extraction_model():
+    """
+    Create the Gemini model with the static extraction instructions as its system instruction.
+    (Context caching is not used: it needs a pinned model version, not a -latest alias, and a
+    prompt of at least 32k tokens, far more than these instructions.)
+    """
+    return genai.GenerativeModel(GEMINI_MODEL, system_instruction=EXTRACTION_INSTRUCTIONS,
+                                 generation_config=GENERATION_CONFIG)
+
 # --- 4. MAIN EXECUTION SCRIPT ---
 
-# Configure and initialize the chosen API client
-api_client = None
-if ANALYSIS_MODEL == 'gemini':
-    try:
-        genai.configure(api_key=API_KEY)
-        api_client = genai.GenerativeModel('gemini-1.5-pro-latest') # Use the Pro model
-        print("Gemini API configured successfully with '2.5 Pro' model.")
-    except Exception as e:
-        print(f"Failed to configure Gemini API: {e}")
-# Add other model configurations here if needed
-
-if api_client:
-    if not os.path.isdir(PDF_FOLDER):
-        print(f"Error: The folder '{PDF_FOLDER}' does not exist.")
-    else:
-        if USE_FILE_LIST and os.path.exists(FILES_LIST_PATH):
-            # Read files from text file
-            with open(FILES_LIST_PATH, 'r') as f:
-                files_to_process = [line.strip() for line in f.readlines() if line.strip()]
-            print(f"--- FILE LIST MODE: Processing {len(files_to_process)} files from {FILES_LIST_PATH} ---")
-        elif SPECIFIC_FILES_TO_PROCESS:
-            files_to_process = SPECIFIC_FILES_TO_PROCESS
-            print(f"--- SPECIFIC FILES MODE: Processing {len(files_to_process)} user-defined file(s). ---")
-        else:
-            files_to_process = [f for f in os.listdir(PDF_FOLDER) if f.lower().endswith('.pdf')]
-            print(f"--- FULL FOLDER MODE: Processing all {len(files_to_process)} PDFs found. ---")
+if __name__ == "__main__":
+    API_KEY = get_api_key()
 
-        all_results = []
-        
-        for filename in tqdm(files_to_process, desc="Extracting Data"):
-            pdf_path = os.path.join(PDF_FOLDER, filename)
-            if not os.path.exists(pdf_path):
-                print(f"Warning: '{filename}' not found, skipping.")
-                continue
+    # Configure and initialize the chosen API client
+    api_client = None
+    if ANALYSIS_MODEL == 'gemini':
+        try:
+            genai.configure(api_key=API_KEY)
+            api_client = create_extraction_model()
+            print(f"Gemini API configured successfully with '{GEMINI_MODEL}' model.")
+        except Exception as e:
+            print(f"Failed to configure Gemini API: {e}")
+    # Add other model configurations here if needed
 
-            pdf_text, status = extract_text_from_pdf(pdf_path)
-            
-            if pdf_text:
-                # Call the data extraction function
-                extracted_data = extract_data_with_gemini(pdf_text, api_client)
-                extracted_data.filename = filename # Add filename for reference
-                all_results.append(extracted_data)
+    if api_client:
+        if not os.path.isdir(PDF_FOLDER):
+            print(f"Error: The folder '{PDF_FOLDER}' does not exist.")
+        else:
+            if USE_FILE_LIST and os.path.exists(FILES_LIST_PATH):
+                # Read files from text file
+                with open(FILES_LIST_PATH, 'r') as f:
+                    files_to_process = [line.strip() for line in f.readlines() if line.strip()]
+                print(f"--- FILE LIST MODE: Processing {len(files_to_process)} files from {FILES_LIST_PATH} ---")
+            elif SPECIFIC_FILES_TO_PROCESS:
+                files_to_process = SPECIFIC_FILES_TO_PROCESS
+                print(f"--- SPECIFIC FILES MODE: Processing {len(files_to_process)} user-defined file(s). ---")
             else:
-                error_data = ExtractedData(filename=filename, error=status)
-                all_results.append(error_data)
-            
-            # Rate limiting
-            time.sleep(5) 
-
-        # --- NEW: Process and save all results at the end ---
-        # Convert structured data to flat dictionaries for CSV
-        flat_results = [result.to_dict() for result in all_results]
-        final_df = pd.DataFrame(flat_results)
-        final_df.to_csv(OUTPUT_CSV, index=False, encoding='utf-8')
-
-        print(f"\n✅ Data extraction complete! Results saved to '{OUTPUT_CSV}'.")
-        print("Here are the first few rows of your extracted data:")
-        print(final_df.head())
\ No newline at end of file
+                files_to_process = [f for f in os.listdir(PDF_FOLDER) if f.lower().endswith('.pdf')]
+                print(f"--- FULL FOLDER MODE: Processing all {len(files_to_process)} PDFs found. ---")
+
+            # Skip papers already written by an earlier, interrupted run
+            existing_header, completed = load_completed_filenames(OUTPUT_CSV, drop_errors=RETRY_FAILED_ON_RESUME)
+            if existing_header is not None and existing_header != CSV_FIELDNAMES:
+                print(f"Error: '{OUTPUT_CSV}' has different columns than this script writes. "
+                      "Choose a new OUTPUT_CSV or move the old file. Exiting.")
+                exit(1)
+            if completed:
+                files_to_process = [f for f in files_to_process if f not in completed]
+                print(f"--- RESUMING: {len(completed)} file(s) already in '{OUTPUT_CSV}', "
+                      f"{len(files_to_process)} remaining. ---")
+
+            files_to_process = filter_existing_pdfs(files_to_process)
+
+            response_cache = ResponseCache(RESPONSE_CACHE_PATH) if USE_RESPONSE_CACHE else None
+            try:
+                with open(OUTPUT_CSV, 'a', newline='', encoding='utf-8') as f:
+                    result_writer = CsvResultWriter(f)
+                    if USE_BATCH_API:
+                        for result in run_batch_extraction(files_to_process):
+                            result_writer.write(result)
+                    else:
+                        asyncio.run(run_extraction(files_to_process, api_client, result_writer, response_cache))
+            finally:
+                if response_cache:
+                    response_cache.close()
+
+            print(f"\n✅ Data extraction complete! Results saved to '{OUTPUT_CSV}'.")
+            print(f"{result_writer.rows_written} rows written ({result_writer.error_count} with errors).")
@@ -9,15 +9,26 @@ import warnings
 warnings.filterwarnings("ignore", message="Field.*has conflict with protected namespace.*model_.*")
 
 import os
+import io
+import csv
+import re
 import pandas as pd
 import json
 import fitz  # PyMuPDF
-from tqdm.notebook import tqdm
+from tqdm.auto import tqdm  # Picks the notebook or terminal progress bar automatically
 from getpass import getpass
 import time
-from dataclasses import dataclass
+import hashlib
+import sqlite3
+import threading
+import functools
+import contextlib
+import multiprocessing
+from dataclasses import dataclass, fields
 from typing import Optional, Dict, Any
 from pathlib import Path
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 
 # AI API imports
 import google.generativeai as genai
@@ -32,11 +43,15 @@ except ImportError:
 # Docling imports
 from docling.datamodel.base_models import InputFormat
 from docling.datamodel.pipeline_options import PdfPipelineOptions, TableFormerMode
+try:
+    from docling.datamodel.accelerator_options import AcceleratorDevice, AcceleratorOptions
+except ImportError:  # Older Docling releases keep these in pipeline_options
+    from docling.datamodel.pipeline_options import AcceleratorDevice, AcceleratorOptions
 from docling.document_converter import DocumentConverter, PdfFormatOption
 from docling_core.types.doc import ImageRefMode
 
 # Use same data classes from extract_data_docling_gemini_v2.py
-@dataclass
+@dataclass(slots=True)
 class StudyIdentification:
     title: Optional[str] = None
     lead_author: Optional[str] = None
@@ -45,13 +60,13 @@ class StudyIdentification:
     doi: Optional[str] = None
     country: Optional[str] = None
 
-@dataclass
+@dataclass(slots=True)
 class StudyCharacteristics:
     study_aim: Optional[str] = None
     followup_duration: Optional[str] = None
     multisite_study: Optional[str] = None
 
-@dataclass
+@dataclass(slots=True)
 class Participants:
     clinical_population: Optional[str] = None
     n_patient_group: Optional[str] = None
@@ -66,7 +81,7 @@ class Participants:
     gender_distribution_patient: Optional[str] = None
     gender_distribution_control: Optional[str] = None
 
-@dataclass
+@dataclass(slots=True)
 class MRIAcquisition:
     scanner_strength: Optional[str] = None
     scanner_manufacturer: Optional[str] = None
@@ -78,7 +93,7 @@ class MRIAcquisition:
     te: Optional[str] = None
     acquisition_time: Optional[str] = None
 
-@dataclass
+@dataclass(slots=True)
 class AnalysisMethods:
     preprocessing_steps: Optional[str] = None
     analysis_software: Optional[str] = None
@@ -89,18 +104,18 @@ class AnalysisMethods:
     if_atlas_name_of_atlas: Optional[str] = None
     roi_definition_method: Optional[str] = None
 
-@dataclass
+@dataclass(slots=True)
 class FreeWaterResults:
     clinical_group_fw_values: Optional[str] = None
     control_group_fw_values: Optional[str] = None
     group_comparison_p_value: Optional[str] = None
 
-@dataclass
+@dataclass(slots=True)
 class Correlations:
     correlations_reported: Optional[str] = None
     correlation_coefficients: Optional[str] = None
 
-@dataclass
+@dataclass(slots=True)
 class KeyFindings:
     longitudinal_data_available: Optional[str] = None
     longitudinal_data_results: Optional[str] = None
@@ -109,7 +124,7 @@ class KeyFindings:
     key_limitations: Optional[str] = None
     other_measures: Optional[str] = None
 
-@dataclass
+@dataclass(slots=True)
 class ExtractedData:
     filename: Optional[str] = None
     identification: Optional[StudyIdentification] = None
@@ -131,86 +146,11 @@ class ExtractedData:
             result['error'] = self.error
             return result
             
-        if self.identification:
-            result.update({
-                'title': self.identification.title,
-                'lead_author': self.identification.lead_author,
-                'year': self.identification.year,
-                'journal': self.identification.journal,
-                'doi': self.identification.doi,
-                'country': self.identification.country
-            })
-            
-        if self.characteristics:
-            result.update({
-                'study_aim': self.characteristics.study_aim,
-                'followup_duration': self.characteristics.followup_duration,
-                'multisite_study': self.characteristics.multisite_study
-            })
-            
-        if self.participants:
-            result.update({
-                'clinical_population': self.participants.clinical_population,
-                'n_patient_group': self.participants.n_patient_group,
-                'n_control_group': self.participants.n_control_group,
-                'n_overall': self.participants.n_overall,
-                'mean_age_patient': self.participants.mean_age_patient,
-                'sd_age_patient': self.participants.sd_age_patient,
-                'mean_age_control': self.participants.mean_age_control,
-                'sd_age_control': self.participants.sd_age_control,
-                'age_range_patient': self.participants.age_range_patient,
-                'age_range_control': self.participants.age_range_control,
-                'gender_distribution_patient': self.participants.gender_distribution_patient,
-                'gender_distribution_control': self.participants.gender_distribution_control
-            })
-            
-        if self.mri_acquisition:
-            result.update({
-                'scanner_strength': self.mri_acquisition.scanner_strength,
-                'scanner_manufacturer': self.mri_acquisition.scanner_manufacturer,
-                'b_values': self.mri_acquisition.b_values,
-                'gradient_directions': self.mri_acquisition.gradient_directions,
-                'reverse_phase_encoding': self.mri_acquisition.reverse_phase_encoding,
-                'voxel_size': self.mri_acquisition.voxel_size,
-                'tr': self.mri_acquisition.tr,
-                'te': self.mri_acquisition.te,
-                'acquisition_time': self.mri_acquisition.acquisition_time
-            })
-            
-        if self.analysis_methods:
-            result.update({
-                'preprocessing_steps': self.analysis_methods.preprocessing_steps,
-                'analysis_software': self.analysis_methods.analysis_software,
-                'analysis_approach': self.analysis_methods.analysis_approach,
-                'free_water_method': self.analysis_methods.free_water_method,
-                'regions_analyzed': self.analysis_methods.regions_analyzed,
-                'free_water_metrics_reported': self.analysis_methods.free_water_metrics_reported,
-                'if_atlas_name_of_atlas': self.analysis_methods.if_atlas_name_of_atlas,
-                'ROI_definition_method': self.analysis_methods.roi_definition_method
-            })
-            
-        if self.free_water_results:
-            result.update({
-                'clinical_group_fw_values': self.free_water_results.clinical_group_fw_values,
-                'control_group_fw_values': self.free_water_results.control_group_fw_values,
-                'group_comparison_p_value': self.free_water_results.group_comparison_p_value
-            })
-            
-        if self.correlations:
-            result.update({
-                'correlations_reported': self.correlations.correlations_reported,
-                'correlation_coefficients': self.correlations.correlation_coefficients
-            })
-            
-        if self.key_findings:
-            result.update({
-                'longitudinal_data_available': self.key_findings.longitudinal_data_available,
-                'longitudinal_data_results': self.key_findings.longitudinal_data_results,
-                'primary_finding': self.key_findings.primary_finding,
-                'main_interpretation': self.key_findings.main_interpretation,
-                'key_limitations': self.key_findings.key_limitations,
-                'other_measures': self.key_findings.other_measures
-            })
+        for attr_name, columns in SECTION_COLUMNS:
+            section = getattr(self, attr_name)
+            if section:
+                for field_name, column in columns:
+                    result[column] = getattr(section, field_name)
             
         return result
 
@@ -220,8 +160,52 @@ SPECIFIC_FILES_TO_PROCESS = []  # Will be loaded from file
 PDF_FOLDER = r'/home/uqahonne/uq/FW_systematic_review/systematic_review/PDFs_only/confirmed_pdfs'
 FILE_LIST_PATH = '/home/uqahonne/uq/FW_systematic_review/systematic_review/PDFs_only/Z_files_to_process.txt'
 OUTPUT_CSV = 'Z_hybrid_docling_pymupdf_extraction_results.csv'
+# Papers already in OUTPUT_CSV are skipped on a rerun. When True, rows that recorded an
+# error are removed first so those papers are attempted again.
+RETRY_FAILED_ON_RESUME = True
 DOCLING_OUTPUT_FOLDER = "docling_out"
 DOCLING_OUTPUT_DIR = Path(DOCLING_OUTPUT_FOLDER)
+# Also write Docling's markdown and tables to DOCLING_OUTPUT_FOLDER for inspection.
+# The extraction itself works from memory, so this can be turned off for speed.
+SAVE_INTERMEDIATES = True
+# TableFormer mode: 'fast' is roughly 2-3x quicker on table-heavy papers with a small accuracy
+# loss; use 'accurate' for final runs (or export DOCLING_MODE=accurate)
+DOCLING_MODE = os.getenv('DOCLING_MODE', 'fast').lower()
+# Check each PDF with PyMuPDF's table finder first and skip Docling when it finds no tables,
+# since Docling's value is in the tables (set SKIP_DOCLING_WITHOUT_TABLES=0 to always run it)
+SKIP_DOCLING_WITHOUT_TABLES = os.getenv('SKIP_DOCLING_WITHOUT_TABLES', '1') != '0'
+# Device for Docling's layout and TableFormer models: 'auto' uses CUDA/MPS when present, else 'cpu', 'cuda' or 'mps'
+DOCLING_DEVICE = os.getenv('DOCLING_DEVICE', 'auto').lower()
+DOCLING_THREADS = int(os.getenv('DOCLING_THREADS', '4'))  # Torch threads per worker
+# Each worker loads its own copy of the models onto the GPU; workers are capped to fit in GPU memory
+DOCLING_GPU_MEMORY_PER_WORKER_GB = float(os.getenv('DOCLING_GPU_MEMORY_PER_WORKER_GB', '3'))
+# Worker processes, each running Docling + PyMuPDF + AI on one PDF at a time.
+# Docling loads its models in every worker, so memory grows with this number.
+HYBRID_WORKERS = int(os.getenv('HYBRID_WORKERS', str(min(os.cpu_count() or 1, 6))))
+# Papers sent to the AI in one request per extraction method (row-marshaling). With 1, each
+# paper gets its own requests. Larger values amortize the long instructions over several papers.
+DOCS_PER_CALL = int(os.getenv('DOCS_PER_CALL', '1'))
+# Input budget for one batched request, estimated at ~4 characters per token
+BATCH_MAX_INPUT_TOKENS = {'gemini': 800_000, 'claude': 180_000}
+# Input budget for one paper's request, measured with the model's tokenizer. Longer papers are
+# trimmed to fit before sending instead of being rejected by the API after the upload.
+MAX_INPUT_TOKENS = {'gemini': 1_000_000, 'claude': 200_000}
+# Docling table data sent with a paper is cut to this many characters, to leave room for the paper text
+MAX_TABLE_DATA_CHARS = 300_000
+
+# Models used for extraction
+GEMINI_MODEL = 'gemini-2.5-pro'
+CLAUDE_MODEL = 'claude-sonnet-4-20250514'
+
+# Response cache: AI responses keyed on PDF hash + prompt version + model, and Docling
+# conversions keyed on PDF hash + pipeline options, so reruns skip repeated work.
+# Delete the file to start fresh.
+USE_RESPONSE_CACHE = True
+RESPONSE_CACHE_PATH = '.hybrid_llm_cache.sqlite'
+
+# Minimum seconds between AI requests, per worker. Only the requests are spaced, so a worker
+# extracts its next PDF while it waits instead of sleeping after every file.
+AI_REQUEST_INTERVAL = float(os.getenv('AI_REQUEST_INTERVAL', '5'))
 
 # AI Model Selection
 def select_ai_model():
@@ -261,15 +245,11 @@ def select_ai_model():
         else:
             print("Invalid choice. Please enter 1 or 2.")
 
-# Select AI model and validate API key
-AI_MODEL, API_KEY = select_ai_model()
-
-# Docling prompt (emphasizes table data)
-DOCLING_EXTRACTION_PROMPT = """
+# Extraction instructions shared by both methods: the role and every field except the free water results.
+# It is the first part of each request, so the API can cache it across Docling and PyMuPDF requests.
+EXTRACTION_INSTRUCTIONS = """
 You are a meticulous research assistant conducting systematic data extraction for a meta-analysis on free water diffusion MRI studies.
 
-CRITICAL INSTRUCTION: You have access to both the full paper text AND extracted table data. Use BOTH sources to extract the most accurate information. For numerical values, prioritize the table data which contains exact values.
-
 Extract the following information from the provided paper. Write "Not reported" if unavailable.
 
 **STUDY IDENTIFICATION**
@@ -320,13 +300,6 @@ Extract the following information from the provided paper. Write "Not reported"
 - If atlas name of atlas: [If brain atlas was used, specify name e.g., "JH-ICBM-DTI-81", "AAL", "Harvard-Oxford", or "Not reported"]
 - ROI definition method: [How ROIs were defined, e.g., "Manual", "Atlas-based", "Automated"]
 
-**FREE WATER RESULTS - USE TABLE DATA**
-CRITICAL: Use the extracted table data to provide exact numerical values for each brain region.
-
-- Clinical group FW values: [Extract exact values from table data for each region, format: "Region: Mean ± SD" for all regions]
-- Control group FW values: [Extract exact values from table data for each region, format: "Region: Mean ± SD" for all regions]  
-- Group comparison p-value: [Extract p-values from table data]
-
 **CORRELATIONS**
 - Correlations reported: [Yes/No - whether correlations with clinical measures were reported]
 - Correlation coefficients: [If correlations reported, list the correlation values and associated measures]
@@ -338,7 +311,38 @@ CRITICAL: Use the extracted table data to provide exact numerical values for eac
 - Main interpretation: [Authors' conclusion]
 - Key limitations: [Main limitations mentioned]
 - Other measures: [ROC AUC, mediation, effect sizes etc. if reported]
+"""
+
+# Docling focus (emphasizes table data)
+DOCLING_FOCUS = """
+CRITICAL INSTRUCTION: You have access to both the full paper text AND extracted table data. Use BOTH sources to extract the most accurate information. For numerical values, prioritize the table data which contains exact values.
+
+**FREE WATER RESULTS - USE TABLE DATA**
+CRITICAL: Use the extracted table data to provide exact numerical values for each brain region.
+
+- Clinical group FW values: [Extract exact values from table data for each region, format: "Region: Mean ± SD" for all regions]
+- Control group FW values: [Extract exact values from table data for each region, format: "Region: Mean ± SD" for all regions]  
+- Group comparison p-value: [Extract p-values from table data]
+"""
+
+# PyMuPDF focus (emphasizes comprehensive text analysis)
+PYMUPDF_FOCUS = """
+CRITICAL INSTRUCTION: Focus on extracting information from the complete text, including values that may be embedded in paragraphs, figure captions, or results sections. Pay special attention to free water values that may be described in text rather than tables.
+
+**FREE WATER RESULTS - COMPREHENSIVE TEXT SEARCH**
+CRITICAL: Look for free water values anywhere in the text - in results sections, figure captions, tables, or embedded in paragraphs. Include exact numerical values with error bars.
+
+- Clinical group FW values: [Search entire text for patient/clinical group free water values, include exact numbers with standard deviations]
+- Control group FW values: [Search entire text for control group free water values, include exact numbers with standard deviations]
+- Group comparison p-value: [Search for p-values related to group comparisons]
+"""
 
+# Static instruction parts, sent first and unchanged in every request so they can be cached by the API
+DOCLING_INSTRUCTIONS = (EXTRACTION_INSTRUCTIONS, DOCLING_FOCUS)
+PYMUPDF_INSTRUCTIONS = (EXTRACTION_INSTRUCTIONS, PYMUPDF_FOCUS)
+
+# Per-paper parts of each request
+DOCLING_PAPER_PROMPT = """
 Here is the full text of the paper:
 ---
 {paper_text}
@@ -352,240 +356,526 @@ Here are the extracted tables (CSV format):
 REMEMBER: Use the table data to extract exact numerical values for free water measurements and demographics. Combine information from both the paper text and the structured table data for the most accurate extraction.
 """
 
-# PyMuPDF prompt (emphasizes comprehensive text analysis)
-PYMUPDF_EXTRACTION_PROMPT = """
-You are a meticulous research assistant conducting systematic data extraction for a meta-analysis on free water diffusion MRI studies.
-
-CRITICAL INSTRUCTION: Focus on extracting information from the complete text, including values that may be embedded in paragraphs, figure captions, or results sections. Pay special attention to free water values that may be described in text rather than tables.
-
-Extract the following information from the provided paper. Write "Not reported" if unavailable.
+PYMUPDF_PAPER_PROMPT = """
+Here is the full text of the paper:
+---
+{paper_text}
+---
 
-**STUDY IDENTIFICATION**
-- Title: [Exact title]
-- Lead author: [First author surname, initials]
-- Year: [YYYY]
-- Journal: [Full name]
-- DOI: [Complete DOI]
-- Country: [specify]
+REMEMBER: Focus on comprehensive text analysis. Extract any numerical values mentioned anywhere in the document, especially free water measurements that may be embedded in results paragraphs or figure descriptions.
+"""
 
-**STUDY CHARACTERISTICS**
-- Study aim: [One sentence describing primary objective]
-- Follow-up duration: [If longitudinal, specify duration]
-- Multi-site study: [Yes/No]
+# Prompt version for response cache keys: editing a prompt or model invalidates earlier answers
+PROMPT_FINGERPRINT = hashlib.sha256(json.dumps(
+    [EXTRACTION_INSTRUCTIONS, DOCLING_FOCUS, PYMUPDF_FOCUS, DOCLING_PAPER_PROMPT, PYMUPDF_PAPER_PROMPT,
+     GEMINI_MODEL, CLAUDE_MODEL]
+).encode('utf-8')).hexdigest()[:16]
 
-**PARTICIPANTS**
-- Clinical population: [Specific clinical condition/disease]
-- N patient group: [Number of patients]
-- N control group: [Number of controls]
-- N overall: [Total number of participants]
-- Mean age patient: [Mean age of patient group]
-- SD age patient: [Standard deviation of patient age]
-- Mean age control: [Mean age of control group]
-- SD age control: [Standard deviation of control age]
-- Age range patient: [Age range of patient group, e.g., "25-65 years"]
-- Age range control: [Age range of control group]
-- Gender distribution patient: [e.g., "12M/8F" or "60% male"]
-- Gender distribution control: [e.g., "10M/10F" or "50% male"]
+class RequestSpacer:
+    """Keeps at least `interval` seconds between the starts of requests made by this process's threads"""
 
-**MRI ACQUISITION**
-- Scanner strength: [1.5T/3T/7T]
-- Scanner manufacturer: [Siemens/GE/Philips/Other]
-- b-values: [List all b-values used, e.g., "0, 1000, 2000 s/mm²"]
-- Gradient directions: [Total number of gradient directions]
-- Reverse phase-encoding: [Yes/No]
-- Voxel size: [e.g., "2×2×2 mm³"]
-- TR: [milliseconds]
-- TE: [milliseconds]
-- Acquisition time: [minutes]
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._next_start = 0.0
 
-**ANALYSIS METHODS**
-- Preprocessing steps: [Software/methods used for preprocessing, e.g., "FSL", "SPM"]
-- Analysis software: [Software used for analysis, e.g., "MATLAB", "Python"]
-- Analysis approach: [Whole-brain/ROI/Tract-based/Voxel-wise]
-- Free-water method: [Free-water imaging/NODDI/DBSI/Other - specify method]
-- Regions analyzed: [List specific brain regions/tracts analyzed]
-- Free-water metrics reported: [Specific metrics like "FW fraction", "ISOVF", "ICVF" etc.]
-- If atlas name of atlas: [If brain atlas was used, specify name e.g., "JH-ICBM-DTI-81", "AAL", "Harvard-Oxford", or "Not reported"]
-- ROI definition method: [How ROIs were defined, e.g., "Manual", "Atlas-based", "Automated"]
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + self.interval
+        if start > now:
+            time.sleep(start - now)
 
-**FREE WATER RESULTS - COMPREHENSIVE TEXT SEARCH**
-CRITICAL: Look for free water values anywhere in the text - in results sections, figure captions, tables, or embedded in paragraphs. Include exact numerical values with error bars.
+AI_REQUEST_SPACER = RequestSpacer(AI_REQUEST_INTERVAL)
 
-- Clinical group FW values: [Search entire text for patient/clinical group free water values, include exact numbers with standard deviations]
-- Control group FW values: [Search entire text for control group free water values, include exact numbers with standard deviations]
-- Group comparison p-value: [Search for p-values related to group comparisons]
+class ResponseCache:
+    """Persistent key -> text map backed by SQLite, shared by the worker processes and their threads"""
 
-**CORRELATIONS**
-- Correlations reported: [Yes/No - whether correlations with clinical measures were reported]
-- Correlation coefficients: [If correlations reported, list the correlation values and associated measures]
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL)")
 
-**KEY FINDINGS**
-- Longitudinal data available: [Yes/No - whether the study collected longitudinal data]
-- Longitudinal data results: [If longitudinal data available, summarize key longitudinal findings]
-- Primary finding: [One sentence summary of main result]
-- Main interpretation: [Authors' conclusion]
-- Key limitations: [Main limitations mentioned]
-- Other measures: [ROC AUC, mediation, effect sizes etc. if reported]
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
 
-Here is the full text of the paper:
----
-{paper_text}
----
+    def set(self, key, response):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO responses (key, response) VALUES (?, ?)", (key, response))
 
-REMEMBER: Focus on comprehensive text analysis. Extract any numerical values mentioned anywhere in the document, especially free water measurements that may be embedded in results paragraphs or figure descriptions.
-"""
+# Per-process cache connection, opened by init_worker
+RESPONSE_CACHE = None
 
+def file_sha256(path):
+    """SHA-256 of a file's bytes, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-def extract_text_from_pdf_pymupdf(pdf_path):
-    """Extract text from PDF using PyMuPDF"""
+def read_pdf_pymupdf(pdf_path, check_tables=False):
+    """
+    Open the PDF once with PyMuPDF for its text and, if asked, whether any page has a table.
+    Returns (text, status, has_tables); has_tables is True when unchecked or the PDF can't be read,
+    so Docling still runs (and reports the problem).
+    """
     try:
-        text = ""
-        pdf_document = fitz.open(pdf_path)
+        # "with" closes the document even on errors
+        with fitz.open(pdf_path) as pdf_document:
+            page_texts = []
+            has_tables = not check_tables
+            for page in pdf_document:
+                page_texts.append(page.get_text("text"))
+                if not has_tables:
+                    has_tables = bool(page.find_tables().tables)
+        text = "".join(page_texts)
         
-        for page_num in range(len(pdf_document)):
-            page = pdf_document[page_num]
-            text += page.get_text()
-        
-        pdf_document.close()
         print(f"PyMuPDF extracted: {len(text)} characters")
-        return text, "Success"
+        return text, "Success", has_tables
         
     except Exception as e:
-        return None, f"Error with PyMuPDF extraction: {e}"
+        return None, f"Error with PyMuPDF extraction: {e}", True
+
+def extract_text_from_pdf_pymupdf(pdf_path):
+    """Extract text from PDF using PyMuPDF"""
+    text, status, _ = read_pdf_pymupdf(pdf_path)
+    return text, status
+
+def skipped_docling_result():
+    """Stand-in Docling result for a PDF without tables; merging then uses PyMuPDF alone"""
+    return ExtractedData(error="Skipped: no tables found", extraction_method="docling_skipped")
+
+def build_docling_options():
+    """Docling PDF pipeline options used for every conversion"""
+    opts = PdfPipelineOptions()
+    opts.do_ocr = False  # Set True for scanned PDFs
+    opts.do_table_structure = True
+    opts.table_structure_options.mode = TableFormerMode.FAST if DOCLING_MODE == 'fast' else TableFormerMode.ACCURATE
+    opts.generate_page_images = False  # Skip images for speed
+    opts.generate_picture_images = False
+    opts.generate_table_images = False
+    opts.do_picture_classification = False
+    opts.do_formula_enrichment = False
+    opts.accelerator_options = AcceleratorOptions(device=AcceleratorDevice(DOCLING_DEVICE),
+                                                  num_threads=DOCLING_THREADS)
+    return opts
 
-def extract_with_docling(pdf_path):
-    """Extract text and tables from PDF using Docling"""
+def max_gpu_workers():
+    """Number of workers whose Docling models fit in CUDA memory, or None when Docling won't use CUDA"""
+    if DOCLING_DEVICE not in ('auto', 'cuda'):
+        return None
+    try:
+        import torch
+    except ImportError:
+        return None
+    if not torch.cuda.is_available():
+        return None
+    total_gb = torch.cuda.get_device_properties(0).total_memory / 1024 ** 3
+    return max(1, int(total_gb // DOCLING_GPU_MEMORY_PER_WORKER_GB))
+
+@functools.lru_cache(maxsize=1)
+def docling_options_digest():
+    """Short hash of the pipeline options, part of the Docling cache key"""
+    return hashlib.sha256(build_docling_options().model_dump_json().encode('utf-8')).hexdigest()[:16]
+
+# One converter per process: building it loads the layout and TableFormer models
+_CONVERTER = None
+
+def get_docling_converter():
+    """Return this process's DocumentConverter, creating it on first use"""
+    global _CONVERTER
+    if _CONVERTER is None:
+        _CONVERTER = DocumentConverter(
+            format_options={InputFormat.PDF: PdfFormatOption(pipeline_options=build_docling_options())}
+        )
+    return _CONVERTER
+
+def extract_with_docling(pdf_path, pdf_digest=None):
+    """Extract text and tables from PDF using Docling, reusing a cached conversion when available"""
     try:
         out_dir = DOCLING_OUTPUT_DIR
-        out_dir.mkdir(exist_ok=True)
+        if SAVE_INTERMEDIATES:
+            out_dir.mkdir(exist_ok=True)
         
-        # Configure docling
-        opts = PdfPipelineOptions()
-        opts.do_ocr = False  # Set True for scanned PDFs
-        opts.do_table_structure = True
-        opts.table_structure_options.mode = TableFormerMode.ACCURATE
-        opts.images_scale = 2.0
-        opts.generate_page_images = False  # Skip images for speed
-        opts.generate_picture_images = False
-        opts.generate_table_images = False
+        cache_key = None
+        if RESPONSE_CACHE and pdf_digest:
+            cache_key = f"docling:{pdf_digest}:{docling_options_digest()}"
+            cached = RESPONSE_CACHE.get(cache_key)
+            if cached is not None:
+                cached = json.loads(cached)
+                print("Docling conversion loaded from cache")
+                return cached['markdown'], cached['tables'], "Success"
         
-        converter = DocumentConverter(
-            format_options={InputFormat.PDF: PdfFormatOption(pipeline_options=opts)}
-        )
-        
-        result = converter.convert(pdf_path)
+        result = get_docling_converter().convert(pdf_path)
         doc = result.document
         docname = result.input.file.stem
         
-        # Save markdown
-        md_path = out_dir / f"{docname}.md"
-        doc.save_as_markdown(md_path, image_mode=ImageRefMode.REFERENCED)
-        
-        # Read markdown content
-        with open(md_path, 'r', encoding='utf-8') as f:
-            markdown_text = f.read()
+        # Markdown content, exported in memory rather than saved and read back
+        markdown_text = doc.export_to_markdown(image_mode=ImageRefMode.REFERENCED)
+        if SAVE_INTERMEDIATES:
+            md_path = out_dir / f"{docname}.md"
+            md_path.write_text(markdown_text, encoding='utf-8')
         
-        # Extract and save tables
-        table_data = ""
+        # Extract tables into one buffer (and save each one if requested)
+        table_buffer = io.StringIO()
         table_count = 0
         for i, table in enumerate(doc.tables, start=1):
+            # Tables without any detected cells export to an empty frame
+            if not table.data.table_cells:
+                continue
             df = table.export_to_dataframe()
             if df.empty:
                 continue
             table_count += 1
-            csv_path = out_dir / f"{docname}-table-{i}.csv"
-            df.to_csv(csv_path, index=False)
             
-            # Add table to combined data
-            table_data += f"\n\nTable {i}:\n"
-            table_data += df.to_csv(index=False)
+            # Serialize once for both the combined data and the saved file
+            table_csv = df.to_csv(index=False)
+            table_buffer.write(f"\n\nTable {i}:\n")
+            table_buffer.write(table_csv)
+            if SAVE_INTERMEDIATES:
+                csv_path = out_dir / f"{docname}-table-{i}.csv"
+                csv_path.write_text(table_csv, encoding='utf-8')
+        table_data = table_buffer.getvalue()
         
         print(f"Docling extracted: {len(markdown_text)} characters text, {table_count} tables")
+        if cache_key:
+            RESPONSE_CACHE.set(cache_key, json.dumps({'markdown': markdown_text, 'tables': table_data}))
         return markdown_text, table_data, "Success"
         
     except Exception as e:
         return None, None, f"Error with Docling extraction: {e}"
 
-def extract_data_with_ai(text, table_data, ai_client, ai_model, method="docling"):
-    """Extract data using AI (Gemini or Claude) with method-specific prompt"""
-    if method == "docling":
-        prompt = DOCLING_EXTRACTION_PROMPT.format(
-            paper_text=text[:1_200_000],  # Leave room for table data
-            table_data=table_data[:300_000] if table_data else ""
-        )
-    else:  # pymupdf
-        prompt = PYMUPDF_EXTRACTION_PROMPT.format(
-            paper_text=text[:1_500_000]  # Full text focus
+def call_ai_model(instructions, prompt, ai_client, ai_model, max_tokens=4096, batch=False):
+    """
+    Send the static instruction parts and one prompt to Gemini or Claude and return the response as JSON text.
+    Both APIs are constrained to the extraction schema (an array of papers when batch is set):
+    Gemini through its JSON response mode, Claude through a forced tool call.
+    """
+    AI_REQUEST_SPACER.wait()
+    if ai_model == 'gemini':
+        generation_config = {
+            "response_mime_type": "application/json",
+            "response_schema": GEMINI_BATCH_RESPONSE_SCHEMA if batch else GEMINI_RESPONSE_SCHEMA,
+        }
+        response = ai_client.generate_content([*instructions, prompt], generation_config=generation_config,
+                                              request_options={"timeout": 120})
+        return response.text if hasattr(response, 'text') else ""
+    
+    elif ai_model == 'claude':
+        tool = CLAUDE_BATCH_EXTRACTION_TOOL if batch else CLAUDE_EXTRACTION_TOOL
+        # Each instruction part is marked for prompt caching, so the shared part is billed at the cache rate
+        # for both methods and the method part for repeat requests of the same method
+        response = ai_client.messages.create(
+            model=CLAUDE_MODEL,
+            max_tokens=max_tokens,
+            system=[{"type": "text", "text": part, "cache_control": {"type": "ephemeral"}} for part in instructions],
+            tools=[tool],
+            tool_choice={"type": "tool", "name": tool["name"]},
+            messages=[{"role": "user", "content": prompt}]
         )
+        for block in response.content:
+            if block.type == "tool_use":
+                return json.dumps(block.input["papers"] if batch else block.input)
+        return ""
+    
+    raise ValueError(f"Unsupported AI model: {ai_model}")
+
+def count_input_tokens(instructions, prompt, ai_client, ai_model):
+    """Input tokens for one request, counted by the model's own tokenizer"""
+    if ai_model == 'gemini':
+        return ai_client.count_tokens([*instructions, prompt]).total_tokens
+    return ai_client.messages.count_tokens(
+        model=CLAUDE_MODEL,
+        system=[{"type": "text", "text": part} for part in instructions],
+        messages=[{"role": "user", "content": prompt}]
+    ).input_tokens
+
+def fit_text_to_token_budget(instructions, build_prompt, text, ai_client, ai_model, max_tokens=4096):
+    """
+    Return the longest prefix of the paper text whose prompt fits the model's input budget.
+    The characters-per-token ratio measured on this paper sizes each cut, so it takes few count requests.
+    """
+    budget = MAX_INPUT_TOKENS[ai_model] - max_tokens
+    instructions_length = sum(len(part) for part in instructions)
+    prompt = build_prompt(text)
+    # Fewer than 2 characters per token does not happen in practice, so short papers are never counted
+    if instructions_length + len(prompt) <= budget * 2:
+        return text
+
+    for _ in range(5):
+        tokens = count_input_tokens(instructions, prompt, ai_client, ai_model)
+        if tokens <= budget:
+            return text
+        chars_per_token = (instructions_length + len(prompt)) / tokens
+        excess_chars = int((tokens - budget) * chars_per_token * 1.02) + 1
+        text = text[:max(len(text) - excess_chars, 0)]
+        prompt = build_prompt(text)
+    return text
+
+def fit_prompt_to_token_budget(instructions, build_prompt, text, ai_client, ai_model, max_tokens=4096):
+    """Build the prompt from the longest prefix of the paper text that fits the model's input budget"""
+    return build_prompt(fit_text_to_token_budget(instructions, build_prompt, text, ai_client, ai_model, max_tokens))
+
+def paper_prompt(method, table_data):
+    """Instructions and a paper text -> prompt builder for one paper's request with the given method"""
+    if method == "docling":
+        table_data = table_data[:MAX_TABLE_DATA_CHARS] if table_data else ""
+        return DOCLING_INSTRUCTIONS, lambda paper_text: (
+            DOCLING_PAPER_PROMPT.format(paper_text=paper_text, table_data=table_data) + JSON_RESPONSE_INSTRUCTION)
+    # pymupdf
+    return PYMUPDF_INSTRUCTIONS, lambda paper_text: (
+        PYMUPDF_PAPER_PROMPT.format(paper_text=paper_text) + JSON_RESPONSE_INSTRUCTION)
+
+def response_cache_key(method, ai_model, pdf_digest):
+    """Cache key for one paper's answer with the given method, or None when caching is off"""
+    return f"{method}:{ai_model}:{pdf_digest}:{PROMPT_FINGERPRINT}" if RESPONSE_CACHE and pdf_digest else None
+
+def cached_extraction(cache_key):
+    """The cached answer for a key, or None if there is none or it no longer parses (the paper is sent again)"""
+    cached_response = RESPONSE_CACHE.get(cache_key) if cache_key else None
+    if cached_response is None:
+        return None
+    extracted_data = parse_response_text(cached_response)
+    return None if extracted_data.error else extracted_data
+
+def extract_data_with_ai(text, table_data, ai_client, ai_model, method="docling", pdf_digest=None):
+    """Extract data using AI (Gemini or Claude) with method-specific prompt"""
+    instructions, build_prompt = paper_prompt(method, table_data)
+    
+    if ai_model not in ('gemini', 'claude'):
+        return ExtractedData(error=f"Unsupported AI model: {ai_model}")
     
     try:
-        if ai_model == 'gemini':
-            response = ai_client.generate_content(prompt, request_options={"timeout": 120})
-            raw_response_text = response.text if hasattr(response, 'text') else ""
-        
-        elif ai_model == 'claude':
-            response = ai_client.messages.create(
-                #model="claude-3-5-sonnet-20241022",
-                model="claude-sonnet-4-20250514",
-                max_tokens=4096,
-                messages=[{"role": "user", "content": prompt}]
-            )
-            raw_response_text = response.content[0].text if response.content else ""
-        
-        else:
-            return ExtractedData(error=f"Unsupported AI model: {ai_model}")
+        cache_key = response_cache_key(method, ai_model, pdf_digest)
+        extracted_data = cached_extraction(cache_key)
+        if extracted_data is not None:
+            return extracted_data
         
-        if not raw_response_text:
-            return ExtractedData(error="The AI API returned an empty response, possibly due to a safety filter.")
-            
-        # Try to parse as JSON first
-        try:
-            cleaned_response_text = raw_response_text.strip().lstrip('```json').rstrip('```')
-            json_data = json.loads(cleaned_response_text)
-            return parse_json_response(json_data)
-        except json.JSONDecodeError:
-            # If JSON parsing fails, parse the structured text response
-            return parse_structured_response(raw_response_text)
+        prompt = fit_prompt_to_token_budget(instructions, build_prompt, text, ai_client, ai_model)
+        raw_response_text = call_ai_model(instructions, prompt, ai_client, ai_model)
+        extracted_data = parse_response_text(raw_response_text)
+        # Only answers that parse are cached, so a truncated or garbled reply is not replayed on every rerun
+        if cache_key and not extracted_data.error:
+            RESPONSE_CACHE.set(cache_key, raw_response_text)
+        return extracted_data
         
     except Exception as e:
         return ExtractedData(error=f"An unexpected AI API error occurred: {e}")
 
+def parse_response_text(raw_response_text):
+    """Parse the raw model output as JSON, falling back to the "- Label: value" text format"""
+    if not raw_response_text:
+        return ExtractedData(error="The AI API returned an empty response, possibly due to a safety filter.")
+    
+    # Responses are schema-constrained JSON; the text parser only handles answers cached before that
+    try:
+        json_data = json.loads(raw_response_text)
+    except json.JSONDecodeError:
+        return parse_structured_response(raw_response_text)
+    return parse_json_response(json_data)
+
+# Field names the model must use as JSON keys when several papers share one request
+ALL_FIELD_NAMES = [
+    field.name
+    for section in (StudyIdentification, StudyCharacteristics, Participants, MRIAcquisition,
+                    AnalysisMethods, FreeWaterResults, Correlations, KeyFindings)
+    for field in fields(section)
+]
+
+# Fixed CSV header so rows can be appended as each paper finishes (matches ExtractedData.to_dict)
+CSV_FIELDNAMES = (['filename', 'extraction_method']
+                  + ['ROI_definition_method' if name == 'roi_definition_method' else name
+                     for name in ALL_FIELD_NAMES]
+                  + ['error'])
+
+# Structured output: the model returns one string per field, as JSON matching these schemas
+GEMINI_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {name: {"type": "STRING"} for name in ALL_FIELD_NAMES},
+    "required": ALL_FIELD_NAMES,
+}
+GEMINI_BATCH_RESPONSE_SCHEMA = {"type": "ARRAY", "items": GEMINI_RESPONSE_SCHEMA}
+
+_EXTRACTION_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {name: {"type": "string"} for name in ALL_FIELD_NAMES},
+    "required": ALL_FIELD_NAMES,
+}
+CLAUDE_EXTRACTION_TOOL = {
+    "name": "record_extraction",
+    "description": "Record the data extracted from the paper.",
+    "input_schema": _EXTRACTION_JSON_SCHEMA,
+}
+CLAUDE_BATCH_EXTRACTION_TOOL = {
+    "name": "record_extractions",
+    "description": "Record the data extracted from each document, in document order.",
+    "input_schema": {
+        "type": "object",
+        "properties": {"papers": {"type": "array", "items": _EXTRACTION_JSON_SCHEMA}},
+        "required": ["papers"],
+    },
+}
+
+JSON_RESPONSE_INSTRUCTION = """
+Return the extracted information as a JSON object using exactly these keys (the field labels above
+in snake_case), with "Not reported" for unavailable values:
+""" + ", ".join(ALL_FIELD_NAMES) + "\n"
+
+BATCH_RESPONSE_INSTRUCTION = """
+Return ONLY a JSON array with one object per document, in the same order as the documents above.
+Each object must use exactly these keys, with "Not reported" for unavailable values:
+""" + ", ".join(ALL_FIELD_NAMES) + "\n"
+
+def build_batch_prompt(docs, method):
+    """Instructions plus one prompt holding several papers, followed by the JSON array request"""
+    instructions = DOCLING_INSTRUCTIONS if method == "docling" else PYMUPDF_INSTRUCTIONS
+    parts = []
+    for i, (filename, text, table_data) in enumerate(docs, start=1):
+        parts.append(f"\n=== DOCUMENT {i} (filename={filename}) ===\n{text}\n")
+        if method == "docling" and table_data:
+            parts.append(f"\nExtracted tables for document {i} (CSV format):\n{table_data}\n")
+    parts.append(BATCH_RESPONSE_INSTRUCTION)
+    return instructions, "".join(parts)
+
+def group_docs_by_tokens(docs, max_input_tokens):
+    """Split (filename, text, table_data) tuples into groups of at most DOCS_PER_CALL under a token estimate"""
+    groups, current, current_tokens = [], [], 0
+    for doc in docs:
+        # ~4 characters per token
+        doc_tokens = (len(doc[1]) + len(doc[2] or "")) // 4
+        if current and (len(current) >= DOCS_PER_CALL or current_tokens + doc_tokens > max_input_tokens):
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append(doc)
+        current_tokens += doc_tokens
+    if current:
+        groups.append(current)
+    return groups
+
+def extract_data_with_ai_batch(docs, ai_client, ai_model, method="docling", pdf_digests=None):
+    """
+    Extract several papers with as few AI requests as possible (row-marshaling).
+    Returns {filename: ExtractedData}; every document in a failed request gets the error.
+    Papers answered in the response cache are not sent, and each answer is cached like a single-paper one.
+    """
+    results = {}
+    cache_keys = {}
+    fitted_docs = []
+    for filename, text, table_data in docs:
+        cache_keys[filename] = response_cache_key(method, ai_model, (pdf_digests or {}).get(filename))
+        try:
+            extracted_data = cached_extraction(cache_keys[filename])
+            if extracted_data is None:
+                # Each paper is cut exactly as its own request would be, so it also fits in a group on its own
+                instructions, build_prompt = paper_prompt(method, table_data)
+                text = fit_text_to_token_budget(instructions, build_prompt, text, ai_client, ai_model)
+                fitted_docs.append((filename, text, table_data[:MAX_TABLE_DATA_CHARS] if table_data else table_data))
+                continue
+        except Exception as e:
+            extracted_data = ExtractedData(error=f"An unexpected AI API error occurred: {e}")
+        extracted_data.extraction_method = method
+        results[filename] = extracted_data
+
+    for group in group_docs_by_tokens(fitted_docs, BATCH_MAX_INPUT_TOKENS[ai_model]):
+        try:
+            instructions, prompt = build_batch_prompt(group, method)
+            raw_response_text = call_ai_model(instructions, prompt, ai_client, ai_model, max_tokens=4096 * len(group),
+                                              batch=True)
+            json_rows = json.loads(raw_response_text)
+            if not isinstance(json_rows, list) or len(json_rows) != len(group):
+                raise ValueError(f"expected a JSON array of {len(group)} objects")
+            for (filename, _, _), json_data in zip(group, json_rows):
+                results[filename] = parse_json_response(json_data)
+                if cache_keys[filename] and not results[filename].error:
+                    RESPONSE_CACHE.set(cache_keys[filename], json.dumps(json_data))
+        except Exception as e:
+            for filename, _, _ in group:
+                results[filename] = ExtractedData(error=f"Batched AI request failed: {e}")
+        for filename, _, _ in group:
+            results[filename].extraction_method = method
+    return results
+
 def is_meaningful_value(value):
     """Check if a field contains meaningful data (not empty, 'Not reported', etc.)"""
     if not value or value == "Not reported" or value == "NR" or value.strip() == "":
         return False
     return True
 
+# Field-specific merge priorities; fields not listed use 'prefer_non_empty'
+FIELD_PRIORITIES = {
+    # Prefer docling for structured/technical data
+    'scanner_strength': 'docling',
+    'scanner_manufacturer': 'docling', 
+    'b_values': 'docling',
+    'gradient_directions': 'docling',
+    'voxel_size': 'docling',
+    'tr': 'docling',
+    'te': 'docling',
+
+    # Prefer pymupdf for text-embedded values
+    'clinical_group_fw_values': 'pymupdf',
+    'control_group_fw_values': 'pymupdf',
+    'group_comparison_p_value': 'pymupdf',
+    'correlation_coefficients': 'pymupdf',
+    'key_limitations': 'pymupdf',
+    'main_interpretation': 'pymupdf',
+
+    # Use whichever has data for these fields
+    'title': 'prefer_non_empty',
+    'study_aim': 'prefer_non_empty',
+    'regions_analyzed': 'prefer_non_empty',
+    'primary_finding': 'prefer_non_empty'
+}
+
+# (ExtractedData attribute, data class) for every section
+SECTION_CLASSES = [
+    ('identification', StudyIdentification),
+    ('characteristics', StudyCharacteristics),
+    ('participants', Participants),
+    ('mri_acquisition', MRIAcquisition),
+    ('analysis_methods', AnalysisMethods),
+    ('free_water_results', FreeWaterResults),
+    ('correlations', Correlations),
+    ('key_findings', KeyFindings),
+]
+
+# Per data class: (field name, merge priority) for each field, resolved once at import
+_MERGE_PLAN = {
+    section_class: tuple(
+        (field.name, FIELD_PRIORITIES.get(field.name, 'prefer_non_empty')) for field in fields(section_class)
+    )
+    for _, section_class in SECTION_CLASSES
+}
+
+# Field names of each data class (slotted dataclasses have no __dict__ for vars())
+SECTION_FIELD_NAMES = {
+    section_class: tuple(field.name for field in fields(section_class)) for _, section_class in SECTION_CLASSES
+}
+
+# Per section: (field name, CSV column) pairs, resolved once for to_dict. Field names are the
+# column names, except the ROI column's historical capitalization.
+SECTION_COLUMNS = tuple(
+    (attr_name, tuple(
+        (name, 'ROI_definition_method' if name == 'roi_definition_method' else name)
+        for name in SECTION_FIELD_NAMES[section_class]
+    ))
+    for attr_name, section_class in SECTION_CLASSES
+)
+
+# Section attribute holding each field, for routing parsed values into the data classes
+FIELD_SECTIONS = {
+    field.name: attr_name for attr_name, section_class in SECTION_CLASSES for field in fields(section_class)
+}
+
 def merge_extraction_results(docling_result, pymupdf_result, filename):
     """
     Merge results from both extraction methods using intelligent prioritization
     """
-    # Field-specific priorities
-    FIELD_PRIORITIES = {
-        # Prefer docling for structured/technical data
-        'scanner_strength': 'docling',
-        'scanner_manufacturer': 'docling', 
-        'b_values': 'docling',
-        'gradient_directions': 'docling',
-        'voxel_size': 'docling',
-        'tr': 'docling',
-        'te': 'docling',
-        
-        # Prefer pymupdf for text-embedded values
-        'clinical_group_fw_values': 'pymupdf',
-        'control_group_fw_values': 'pymupdf',
-        'group_comparison_p_value': 'pymupdf',
-        'correlation_coefficients': 'pymupdf',
-        'key_limitations': 'pymupdf',
-        'main_interpretation': 'pymupdf',
-        
-        # Use whichever has data for these fields
-        'title': 'prefer_non_empty',
-        'study_aim': 'prefer_non_empty',
-        'regions_analyzed': 'prefer_non_empty',
-        'primary_finding': 'prefer_non_empty'
-    }
-    
     # Start with docling result as base
     merged = ExtractedData()
     merged.filename = filename
@@ -605,272 +895,193 @@ def merge_extraction_results(docling_result, pymupdf_result, filename):
         return merged
     
     # Merge each data class
-    for attr_name in ['identification', 'characteristics', 'participants', 'mri_acquisition', 
-                      'analysis_methods', 'free_water_results', 'correlations', 'key_findings']:
-        
+    for attr_name, section_class in SECTION_CLASSES:
         docling_attr = getattr(docling_result, attr_name)
         pymupdf_attr = getattr(pymupdf_result, attr_name)
         
         if docling_attr is None and pymupdf_attr is None:
             continue
             
-        # Create new instance of the appropriate class
-        if docling_attr:
-            merged_attr = type(docling_attr)()
-        elif pymupdf_attr:
-            merged_attr = type(pymupdf_attr)()
-        else:
-            continue
-            
         # Merge fields within each data class
-        if docling_attr:
-            for field_name in docling_attr.__annotations__:
-                docling_value = getattr(docling_attr, field_name)
-                pymupdf_value = getattr(pymupdf_attr, field_name) if pymupdf_attr else None
-                
-                # Apply field-specific priority rules
-                priority = FIELD_PRIORITIES.get(field_name, 'prefer_non_empty')
-                
-                if priority == 'docling':
-                    final_value = docling_value if is_meaningful_value(docling_value) else pymupdf_value
-                elif priority == 'pymupdf':
-                    final_value = pymupdf_value if is_meaningful_value(pymupdf_value) else docling_value
-                else:  # prefer_non_empty
-                    if is_meaningful_value(docling_value) and is_meaningful_value(pymupdf_value):
-                        # Both have data, prefer longer/more detailed answer
-                        final_value = docling_value if len(str(docling_value)) >= len(str(pymupdf_value)) else pymupdf_value
-                    elif is_meaningful_value(docling_value):
-                        final_value = docling_value
-                    elif is_meaningful_value(pymupdf_value):
-                        final_value = pymupdf_value
-                    else:
-                        final_value = None
-                
-                setattr(merged_attr, field_name, final_value)
+        merged_values = {}
+        for field_name, priority in _MERGE_PLAN[section_class]:
+            docling_value = getattr(docling_attr, field_name) if docling_attr else None
+            pymupdf_value = getattr(pymupdf_attr, field_name) if pymupdf_attr else None
+            
+            # Apply field-specific priority rules
+            if priority == 'docling':
+                final_value = docling_value if is_meaningful_value(docling_value) else pymupdf_value
+            elif priority == 'pymupdf':
+                final_value = pymupdf_value if is_meaningful_value(pymupdf_value) else docling_value
+            else:  # prefer_non_empty
+                docling_ok = is_meaningful_value(docling_value)
+                pymupdf_ok = is_meaningful_value(pymupdf_value)
+                if docling_ok and pymupdf_ok:
+                    # Both have data, prefer longer/more detailed answer
+                    final_value = docling_value if len(str(docling_value)) >= len(str(pymupdf_value)) else pymupdf_value
+                elif docling_ok:
+                    final_value = docling_value
+                elif pymupdf_ok:
+                    final_value = pymupdf_value
+                else:
+                    final_value = None
+            
+            merged_values[field_name] = final_value
         
-        setattr(merged, attr_name, merged_attr)
+        setattr(merged, attr_name, section_class(**merged_values))
     
     return merged
 
 # Parsing functions (same as v2 script)
+# Labels used in the structured text format ("- Label: value"), mapped to field names
+STRUCTURED_LABELS = {
+    'Title': 'title',
+    'Lead author': 'lead_author',
+    'Year': 'year',
+    'Year of publication': 'year',
+    'Journal': 'journal',
+    'Journal name': 'journal',
+    'DOI': 'doi',
+    'Country': 'country',
+    'Study aim': 'study_aim',
+    'Aim': 'study_aim',
+    'Follow-up duration': 'followup_duration',
+    'Multi-site study': 'multisite_study',
+    'Clinical population': 'clinical_population',
+    'N patient group': 'n_patient_group',
+    'N control group': 'n_control_group',
+    'N overall': 'n_overall',
+    'Mean age patient': 'mean_age_patient',
+    'SD age patient': 'sd_age_patient',
+    'Mean age control': 'mean_age_control',
+    'SD age control': 'sd_age_control',
+    'Age range patient': 'age_range_patient',
+    'Age range control': 'age_range_control',
+    'Gender distribution patient': 'gender_distribution_patient',
+    'Gender distribution control': 'gender_distribution_control',
+    # MRI Acquisition
+    'Scanner strength': 'scanner_strength',
+    'Scanner manufacturer': 'scanner_manufacturer',
+    'b-values': 'b_values',
+    'Gradient directions': 'gradient_directions',
+    'Reverse phase-encoding': 'reverse_phase_encoding',
+    'Voxel size': 'voxel_size',
+    'TR': 'tr',
+    'TE': 'te',
+    'Acquisition time': 'acquisition_time',
+    # Analysis Methods
+    'Preprocessing steps': 'preprocessing_steps',
+    'Analysis software': 'analysis_software',
+    'Analysis approach': 'analysis_approach',
+    'Free-water method': 'free_water_method',
+    'Regions analyzed': 'regions_analyzed',
+    'Free-water metrics reported': 'free_water_metrics_reported',
+    'If atlas name of atlas': 'if_atlas_name_of_atlas',
+    'ROI definition method': 'roi_definition_method',
+    # Free Water Results
+    'Clinical group FW values': 'clinical_group_fw_values',
+    'Control group FW values': 'control_group_fw_values',
+    'Group comparison p-value': 'group_comparison_p_value',
+    # Correlations
+    'Correlations reported': 'correlations_reported',
+    'Correlation coefficients': 'correlation_coefficients',
+    # Key Findings
+    'Longitudinal data available': 'longitudinal_data_available',
+    'Longitudinal data results': 'longitudinal_data_results',
+    'Primary finding': 'primary_finding',
+    'Main interpretation': 'main_interpretation',
+    'Key limitations': 'key_limitations',
+    'Other measures': 'other_measures',
+}
+
+def canonical_label(label):
+    """Case- and spacing-insensitive form of a field label, so 'lead  Author' matches 'Lead author'"""
+    return " ".join(label.split()).casefold()
+
+# STRUCTURED_LABELS keyed by canonical label, for lookups from model output
+CANONICAL_LABELS = {canonical_label(label): field_name for label, field_name in STRUCTURED_LABELS.items()}
+
+# One "- Label: value" line; the label ends at the first ": " and the value must not be blank
+_STRUCTURED_LINE_RE = re.compile(r'^[ \t]*- (?P<label>[^\n]*?): [ \t]*(?P<value>\S[^\n]*)$', re.MULTILINE)
+
+def build_extracted_data(values):
+    """Build ExtractedData with every section from {field name: value}; unknown names are ignored"""
+    section_values = {attr_name: {} for attr_name, _ in SECTION_CLASSES}
+    for field_name, value in values.items():
+        attr_name = FIELD_SECTIONS.get(field_name)
+        if attr_name:
+            section_values[attr_name][field_name] = value
+    return ExtractedData(**{
+        attr_name: section_class(**section_values[attr_name]) for attr_name, section_class in SECTION_CLASSES
+    })
+
 def parse_json_response(json_data):
     """Parse JSON response into structured data classes"""
-    identification = StudyIdentification()
-    characteristics = StudyCharacteristics()
-    participants = Participants()
-    mri_acquisition = MRIAcquisition()
-    analysis_methods = AnalysisMethods()
-    free_water_results = FreeWaterResults()
-    correlations = Correlations()
-    key_findings = KeyFindings()
-    
-    # Map JSON fields to data class fields
-    for key, value in json_data.items():
-        if key in ['title', 'lead_author', 'year', 'journal', 'doi', 'country']:
-            setattr(identification, key, value)
-        elif key in ['study_aim', 'followup_duration', 'multisite_study']:
-            setattr(characteristics, key, value)
-        elif key in ['clinical_population', 'n_patient_group', 'n_control_group', 'n_overall',
-                    'mean_age_patient', 'sd_age_patient', 'mean_age_control', 'sd_age_control',
-                    'age_range_patient', 'age_range_control', 'gender_distribution_patient', 
-                    'gender_distribution_control']:
-            setattr(participants, key, value)
-        elif key in ['scanner_strength', 'scanner_manufacturer', 'b_values', 'gradient_directions', 
-                    'reverse_phase_encoding', 'voxel_size', 'tr', 'te', 'acquisition_time']:
-            setattr(mri_acquisition, key, value)
-        elif key in ['preprocessing_steps', 'analysis_software', 'analysis_approach', 
-                    'free_water_method', 'regions_analyzed', 'free_water_metrics_reported',
-                    'if_atlas_name_of_atlas', 'roi_definition_method']:
-            setattr(analysis_methods, key, value)
-        elif key in ['clinical_group_fw_values', 'control_group_fw_values', 'group_comparison_p_value']:
-            setattr(free_water_results, key, value)
-        elif key in ['correlations_reported', 'correlation_coefficients']:
-            setattr(correlations, key, value)
-        elif key in ['longitudinal_data_available', 'longitudinal_data_results', 'primary_finding',
-                    'main_interpretation', 'key_limitations', 'other_measures']:
-            setattr(key_findings, key, value)
-    
-    return ExtractedData(
-        identification=identification,
-        characteristics=characteristics,
-        participants=participants,
-        mri_acquisition=mri_acquisition,
-        analysis_methods=analysis_methods,
-        free_water_results=free_water_results,
-        correlations=correlations,
-        key_findings=key_findings
-    )
+    if not isinstance(json_data, dict):
+        return ExtractedData(error=f"Expected a JSON object from the AI API, got {type(json_data).__name__}")
+    return build_extracted_data(json_data)
 
 def parse_structured_response(text):
     """Parse structured text response into data classes"""
-    identification = StudyIdentification()
-    characteristics = StudyCharacteristics()
-    participants = Participants()
-    mri_acquisition = MRIAcquisition()
-    analysis_methods = AnalysisMethods()
-    free_water_results = FreeWaterResults()
-    correlations = Correlations()
-    key_findings = KeyFindings()
-    
-    # Split text into lines and process
-    lines = text.strip().split('\n')
-    
-    for line in lines:
-        line = line.strip()
-        if not line or line.startswith('**') or line.startswith('---'):
-            continue
-            
-        # Look for lines with format "- Field: Value"
-        if line.startswith('- ') and ': ' in line:
-            field_part, value_part = line[2:].split(': ', 1)
-            field_name = field_part.strip()
-            value = value_part.strip()
-            
-            # Map to appropriate data class
-            if field_name == 'Title':
-                identification.title = value
-            elif field_name == 'Lead author':
-                identification.lead_author = value
-            elif field_name in ['Year', 'Year of publication']:
-                identification.year = value
-            elif field_name in ['Journal', 'Journal name']:
-                identification.journal = value
-            elif field_name == 'DOI':
-                identification.doi = value
-            elif field_name == 'Country':
-                identification.country = value
-            elif field_name in ['Study aim', 'Aim']:
-                characteristics.study_aim = value
-            elif field_name == 'Follow-up duration':
-                characteristics.followup_duration = value
-            elif field_name == 'Multi-site study':
-                characteristics.multisite_study = value
-            elif field_name == 'Clinical population':
-                participants.clinical_population = value
-            elif field_name == 'N patient group':
-                participants.n_patient_group = value
-            elif field_name == 'N control group':
-                participants.n_control_group = value
-            elif field_name == 'N overall':
-                participants.n_overall = value
-            elif field_name == 'Mean age patient':
-                participants.mean_age_patient = value
-            elif field_name == 'SD age patient':
-                participants.sd_age_patient = value
-            elif field_name == 'Mean age control':
-                participants.mean_age_control = value
-            elif field_name == 'SD age control':
-                participants.sd_age_control = value
-            elif field_name == 'Age range patient':
-                participants.age_range_patient = value
-            elif field_name == 'Age range control':
-                participants.age_range_control = value
-            elif field_name == 'Gender distribution patient':
-                participants.gender_distribution_patient = value
-            elif field_name == 'Gender distribution control':
-                participants.gender_distribution_control = value
-            # MRI Acquisition
-            elif field_name == 'Scanner strength':
-                mri_acquisition.scanner_strength = value
-            elif field_name == 'Scanner manufacturer':
-                mri_acquisition.scanner_manufacturer = value
-            elif field_name == 'b-values':
-                mri_acquisition.b_values = value
-            elif field_name == 'Gradient directions':
-                mri_acquisition.gradient_directions = value
-            elif field_name == 'Reverse phase-encoding':
-                mri_acquisition.reverse_phase_encoding = value
-            elif field_name == 'Voxel size':
-                mri_acquisition.voxel_size = value
-            elif field_name == 'TR':
-                mri_acquisition.tr = value
-            elif field_name == 'TE':
-                mri_acquisition.te = value
-            elif field_name == 'Acquisition time':
-                mri_acquisition.acquisition_time = value
-            # Analysis Methods
-            elif field_name == 'Preprocessing steps':
-                analysis_methods.preprocessing_steps = value
-            elif field_name == 'Analysis software':
-                analysis_methods.analysis_software = value
-            elif field_name == 'Analysis approach':
-                analysis_methods.analysis_approach = value
-            elif field_name == 'Free-water method':
-                analysis_methods.free_water_method = value
-            elif field_name == 'Regions analyzed':
-                analysis_methods.regions_analyzed = value
-            elif field_name == 'Free-water metrics reported':
-                analysis_methods.free_water_metrics_reported = value
-            elif field_name == 'If atlas name of atlas':
-                analysis_methods.if_atlas_name_of_atlas = value
-            elif field_name == 'ROI definition method':
-                analysis_methods.roi_definition_method = value
-            # Free Water Results
-            elif field_name == 'Clinical group FW values':
-                free_water_results.clinical_group_fw_values = value
-            elif field_name == 'Control group FW values':
-                free_water_results.control_group_fw_values = value
-            elif field_name == 'Group comparison p-value':
-                free_water_results.group_comparison_p_value = value
-            # Correlations
-            elif field_name == 'Correlations reported':
-                correlations.correlations_reported = value
-            elif field_name == 'Correlation coefficients':
-                correlations.correlation_coefficients = value
-            # Key Findings
-            elif field_name == 'Longitudinal data available':
-                key_findings.longitudinal_data_available = value
-            elif field_name == 'Longitudinal data results':
-                key_findings.longitudinal_data_results = value
-            elif field_name == 'Primary finding':
-                key_findings.primary_finding = value
-            elif field_name == 'Main interpretation':
-                key_findings.main_interpretation = value
-            elif field_name == 'Key limitations':
-                key_findings.key_limitations = value
-            elif field_name == 'Other measures':
-                key_findings.other_measures = value
-    
-    return ExtractedData(
-        identification=identification,
-        characteristics=characteristics,
-        participants=participants,
-        mri_acquisition=mri_acquisition,
-        analysis_methods=analysis_methods,
-        free_water_results=free_water_results,
-        correlations=correlations,
-        key_findings=key_findings
-    )
+    # A single regex pass finds every "- Label: value" line; later lines win, as the model's corrections do
+    values = {}
+    for match in _STRUCTURED_LINE_RE.finditer(text):
+        field_name = CANONICAL_LABELS.get(canonical_label(match['label']))
+        if field_name:
+            values[field_name] = match['value'].strip()
+    if not values:
+        return ExtractedData(error="Could not parse AI response")
+    return build_extracted_data(values)
 
-def extract_data_hybrid(pdf_path, ai_client, ai_model, filename):
-    """
-    Hybrid extraction: Docling + PyMuPDF with intelligent merging
-    """
-    print(f"\n=== Hybrid Extraction for {filename} using {ai_model.upper()} ===")
-    
-    # Method 1: Docling (best for structured tables)
-    print("Step 1: Extracting with Docling...")
-    markdown_text, table_data, docling_status = extract_with_docling(pdf_path)
+def run_docling_branch(pdf_path, ai_client, ai_model, pdf_digest=None):
+    """Docling extraction followed by its AI call (best for structured tables)"""
+    markdown_text, table_data, docling_status = extract_with_docling(pdf_path, pdf_digest)
     
     if markdown_text and table_data is not None:
-        docling_result = extract_data_with_ai(markdown_text, table_data, ai_client, ai_model, method="docling")
+        docling_result = extract_data_with_ai(markdown_text, table_data, ai_client, ai_model, method="docling",
+                                              pdf_digest=pdf_digest)
         docling_result.extraction_method = "docling"
         print("✅ Docling extraction successful")
     else:
         docling_result = ExtractedData(error=docling_status, extraction_method="docling_failed")
         print(f"❌ Docling extraction failed: {docling_status}")
-    
-    # Method 2: PyMuPDF (best for text-embedded values)
-    print("Step 2: Extracting with PyMuPDF...")
-    pymupdf_text, pymupdf_status = extract_text_from_pdf_pymupdf(pdf_path)
-    
+    return docling_result
+
+def run_pymupdf_branch(pymupdf_text, pymupdf_status, ai_client, ai_model, pdf_digest=None):
+    """AI call on the PyMuPDF text (best for text-embedded values)"""
     if pymupdf_text:
-        pymupdf_result = extract_data_with_ai(pymupdf_text, None, ai_client, ai_model, method="pymupdf")
+        pymupdf_result = extract_data_with_ai(pymupdf_text, None, ai_client, ai_model, method="pymupdf",
+                                              pdf_digest=pdf_digest)
         pymupdf_result.extraction_method = "pymupdf"
         print("✅ PyMuPDF extraction successful")
     else:
         pymupdf_result = ExtractedData(error=pymupdf_status, extraction_method="pymupdf_failed")
         print(f"❌ PyMuPDF extraction failed: {pymupdf_status}")
+    return pymupdf_result
+
+def extract_data_hybrid(pdf_path, ai_client, ai_model, filename):
+    """
+    Hybrid extraction: Docling + PyMuPDF with intelligent merging
+    """
+    print(f"\n=== Hybrid Extraction for {filename} using {ai_model.upper()} ===")
+    
+    # Methods 1 and 2 are independent, so they run side by side: Docling's torch models and
+    # PyMuPDF release the GIL, and the AI calls are network-bound
+    print("Steps 1-2: Extracting with Docling and PyMuPDF...")
+    pdf_digest = file_sha256(pdf_path) if RESPONSE_CACHE else None
+    # One PyMuPDF pass gives the text and the table check, so the PDF is opened only once here
+    pymupdf_text, pymupdf_status, has_tables = read_pdf_pymupdf(pdf_path, check_tables=SKIP_DOCLING_WITHOUT_TABLES)
+    if not has_tables:
+        print("No tables found - skipping Docling")
+        docling_result = skipped_docling_result()
+        pymupdf_result = run_pymupdf_branch(pymupdf_text, pymupdf_status, ai_client, ai_model, pdf_digest)
+    else:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            docling_future = executor.submit(run_docling_branch, pdf_path, ai_client, ai_model, pdf_digest)
+            pymupdf_future = executor.submit(run_pymupdf_branch, pymupdf_text, pymupdf_status, ai_client, ai_model,
+                                             pdf_digest)
+            docling_result = docling_future.result()
+            pymupdf_result = pymupdf_future.result()
     
     # Method 3: Intelligent merging
     print("Step 3: Merging results...")
@@ -880,20 +1091,97 @@ def extract_data_hybrid(pdf_path, ai_client, ai_model, filename):
     print(f"✅ Hybrid extraction complete - Method: {final_result.extraction_method}")
     return final_result
 
+def create_ai_client(ai_model, api_key):
+    """
+    Configure the selected AI API and return its client. Each worker builds one and reuses it for
+    every request, so the connection (and its TLS session) is kept alive between papers.
+    """
+    if ai_model == 'gemini':
+        genai.configure(api_key=api_key)
+        return genai.GenerativeModel(GEMINI_MODEL)
+    elif ai_model == 'claude':
+        # Same 120 s limit as the Gemini requests; a dead connection fails in 5 s instead
+        return anthropic.Anthropic(api_key=api_key, max_retries=2,
+                                   timeout=anthropic.Timeout(120.0, connect=5.0))
+    raise ValueError(f"Unsupported AI model: {ai_model}")
+
+# Per-process state, set by init_worker in each worker process
+AI_MODEL = None
+AI_CLIENT = None
+
+def init_worker(ai_model, api_key):
+    """ProcessPoolExecutor initializer: build this worker's AI client and cache connection once"""
+    global AI_MODEL, AI_CLIENT, RESPONSE_CACHE
+    AI_MODEL = ai_model
+    AI_CLIENT = create_ai_client(ai_model, api_key)
+    if USE_RESPONSE_CACHE:
+        RESPONSE_CACHE = ResponseCache(RESPONSE_CACHE_PATH)
+    # Load the Docling models up front so the first PDF doesn't pay for it
+    get_docling_converter().initialize_pipeline(InputFormat.PDF)
+
+def process_one(filename):
+    """Run the full hybrid extraction for one PDF in a worker process"""
+    pdf_path = os.path.join(PDF_FOLDER, filename)
+    try:
+        extracted_data = extract_data_hybrid(pdf_path, AI_CLIENT, AI_MODEL, filename)
+    except Exception as e:
+        extracted_data = ExtractedData(filename=filename, error=f"Hybrid extraction failed: {e}")
+    return extracted_data
+
+def process_batch(filenames):
+    """Run the hybrid extraction for several PDFs in a worker process, batching the AI requests"""
+    try:
+        docling_docs, pymupdf_docs = [], []
+        docling_results, pymupdf_results = {}, {}
+        pdf_digests = {}
+        for filename in filenames:
+            pdf_path = os.path.join(PDF_FOLDER, filename)
+            pdf_digest = pdf_digests[filename] = file_sha256(pdf_path) if RESPONSE_CACHE else None
+            pymupdf_text, pymupdf_status, has_tables = read_pdf_pymupdf(pdf_path,
+                                                                        check_tables=SKIP_DOCLING_WITHOUT_TABLES)
+            if has_tables:
+                markdown_text, table_data, docling_status = extract_with_docling(pdf_path, pdf_digest)
+
+            if not has_tables:
+                docling_results[filename] = skipped_docling_result()
+            elif markdown_text and table_data is not None:
+                docling_docs.append((filename, markdown_text, table_data))
+            else:
+                docling_results[filename] = ExtractedData(error=docling_status, extraction_method="docling_failed")
+            if pymupdf_text:
+                pymupdf_docs.append((filename, pymupdf_text, None))
+            else:
+                pymupdf_results[filename] = ExtractedData(error=pymupdf_status, extraction_method="pymupdf_failed")
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            docling_future = executor.submit(extract_data_with_ai_batch, docling_docs, AI_CLIENT, AI_MODEL, "docling",
+                                             pdf_digests)
+            pymupdf_future = executor.submit(extract_data_with_ai_batch, pymupdf_docs, AI_CLIENT, AI_MODEL, "pymupdf",
+                                             pdf_digests)
+            docling_results.update(docling_future.result())
+            pymupdf_results.update(pymupdf_future.result())
+
+        merged_results = []
+        for filename in filenames:
+            final_result = merge_extraction_results(docling_results[filename], pymupdf_results[filename], filename)
+            final_result.filename = filename
+            merged_results.append(final_result)
+        return merged_results
+    except Exception as e:
+        return [ExtractedData(filename=filename, error=f"Hybrid extraction failed: {e}") for filename in filenames]
+
 # Main execution
 if __name__ == "__main__":
-    # Configure AI API based on selected model
+    # Select AI model and validate API key
+    AI_MODEL, API_KEY = select_ai_model()
+
+    # Configure AI API based on selected model (once here to fail fast; each worker builds its own client)
     try:
+        create_ai_client(AI_MODEL, API_KEY)
         if AI_MODEL == 'gemini':
-            genai.configure(api_key=API_KEY)
-            ai_client = genai.GenerativeModel('gemini-2.5-pro')
-            print("Gemini API configured successfully with '2.5 Pro' model.")
-        elif AI_MODEL == 'claude':
-            ai_client = anthropic.Anthropic(api_key=API_KEY)
-            print("Claude API configured successfully with 'claude-3-5-sonnet' model.")
+            print(f"Gemini API configured successfully with '{GEMINI_MODEL}' model.")
         else:
-            print(f"Unsupported AI model: {AI_MODEL}")
-            exit(1)
+            print(f"Claude API configured successfully with '{CLAUDE_MODEL}' model.")
     except Exception as e:
         print(f"Failed to configure {AI_MODEL.upper()} API: {e}")
         exit(1)
@@ -916,27 +1204,100 @@ if __name__ == "__main__":
     
     print(f"--- Processing {len(files_to_process)} file(s) with Hybrid Docling + PyMuPDF + {AI_MODEL.upper()} ---")
 
-    all_results = []
-    
-    for filename in tqdm(files_to_process, desc=f"Extracting Data with Hybrid Method ({AI_MODEL.upper()})"):
-        pdf_path = os.path.join(PDF_FOLDER, filename)
-        if not os.path.exists(pdf_path):
-            print(f"Warning: '{filename}' not found, skipping.")
+    # Papers already in the output CSV from an earlier (possibly interrupted) run are not reprocessed
+    completed_files = set()
+    if os.path.exists(OUTPUT_CSV) and os.path.getsize(OUTPUT_CSV) > 0:
+        existing_header = pd.read_csv(OUTPUT_CSV, nrows=0).columns.tolist()
+        if existing_header != CSV_FIELDNAMES:
+            print(f"Error: '{OUTPUT_CSV}' has different columns from this script's output. "
+                  "Move it aside or change OUTPUT_CSV.")
+            exit(1)
+        existing_df = pd.read_csv(OUTPUT_CSV, dtype=str, keep_default_na=False)
+        if RETRY_FAILED_ON_RESUME:
+            failed = existing_df['error'] != ''
+            if failed.any():
+                # Rewritten in place so the retried papers don't end up with two rows
+                temp_path = OUTPUT_CSV + '.tmp'
+                existing_df[~failed].to_csv(temp_path, index=False, encoding='utf-8')
+                os.replace(temp_path, OUTPUT_CSV)
+                print(f"Removed {failed.sum()} failed row(s) from '{OUTPUT_CSV}'; they will be retried.")
+                existing_df = existing_df[~failed]
+        completed_files = set(existing_df['filename'])
+        print(f"Resuming: {len(completed_files)} file(s) already in '{OUTPUT_CSV}' will be skipped.")
+
+    existing_files = []
+    for filename in files_to_process:
+        if filename in completed_files:
             continue
+        if os.path.exists(os.path.join(PDF_FOLDER, filename)):
+            existing_files.append(filename)
+        else:
+            print(f"Warning: '{filename}' not found, skipping.")
 
-        # Hybrid extraction
-        extracted_data = extract_data_hybrid(pdf_path, ai_client, AI_MODEL, filename)
-        all_results.append(extracted_data)
-        
-        # Rate limiting
-        time.sleep(5)
+    # Each row is appended and flushed as soon as its paper finishes, so a crash loses at most the papers in flight
+    with open(OUTPUT_CSV, 'a', newline='', encoding='utf-8') as output_file:
+        writer = csv.DictWriter(output_file, fieldnames=CSV_FIELDNAMES)
+        if output_file.tell() == 0:
+            writer.writeheader()
 
-    # Process and save results
-    flat_results = [result.to_dict() for result in all_results]
-    final_df = pd.DataFrame(flat_results)
-    
-    # Save results using configured output filename
-    final_df.to_csv(OUTPUT_CSV, index=False, encoding='utf-8')
+        # Docling and PyMuPDF are CPU-bound, so PDFs are processed in parallel worker processes
+        workers = HYBRID_WORKERS
+        gpu_workers = max_gpu_workers()
+        if gpu_workers is not None and gpu_workers < workers:
+            print(f"Limiting to {gpu_workers} worker(s) so the Docling models fit in GPU memory.")
+            workers = gpu_workers
+        # CUDA was initialized here to size the pool, and CUDA can't be used in forked children
+        mp_context = multiprocessing.get_context('spawn') if gpu_workers is not None else None
+        progress_desc = f"Extracting Data with Hybrid Method ({AI_MODEL.upper()})"
+        # One job is a group of DOCS_PER_CALL papers sharing AI requests, or a single paper
+        if DOCS_PER_CALL > 1:
+            jobs = iter([existing_files[i:i + DOCS_PER_CALL] for i in range(0, len(existing_files), DOCS_PER_CALL)])
+        else:
+            jobs = iter([[filename] for filename in existing_files])
+
+        def new_pool():
+            return ProcessPoolExecutor(max_workers=workers, mp_context=mp_context, initializer=init_worker,
+                                       initargs=(AI_MODEL, API_KEY))
+
+        def job_results(future, filenames):
+            """Rows for a finished job, or error rows if its worker process crashed"""
+            try:
+                return future.result() if DOCS_PER_CALL > 1 else [future.result()]
+            except BrokenProcessPool as e:
+                error = f"Hybrid extraction failed: worker process crashed ({e})"
+            except Exception as e:
+                error = f"Hybrid extraction failed: {e}"
+            return [ExtractedData(filename=filename, error=error) for filename in filenames]
+
+        with contextlib.ExitStack() as stack, tqdm(total=len(existing_files), desc=progress_desc) as progress:
+            executor = stack.enter_context(new_pool())
+            # One job per worker is handed out at a time, so a crashed worker (Docling running out of memory,
+            # a segfault in a PDF library) takes as few queued papers down with it as possible
+            in_flight = {}
+            while True:
+                while len(in_flight) < workers and (filenames := next(jobs, None)) is not None:
+                    if DOCS_PER_CALL > 1:
+                        in_flight[executor.submit(process_batch, filenames)] = filenames
+                    else:
+                        in_flight[executor.submit(process_one, filenames[0])] = filenames
+                if not in_flight:
+                    break
+
+                # Rows are written in completion order, so one slow PDF doesn't hold back finished ones
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                if any(isinstance(future.exception(), BrokenProcessPool) for future in done):
+                    # A crash breaks the whole pool: the jobs still in it fail too, the rest go to a new one
+                    wait(in_flight)
+                    done = list(in_flight)
+                    executor = stack.enter_context(new_pool())
+                for future in done:
+                    results = job_results(future, in_flight.pop(future))
+                    writer.writerows(result.to_dict() for result in results)
+                    output_file.flush()
+                    progress.update(len(results))
+
+    # Summarise everything in the output file, including rows from earlier runs
+    final_df = pd.read_csv(OUTPUT_CSV, encoding='utf-8')
 
     print(f"\n✅ Hybrid extraction complete! Results saved to '{OUTPUT_CSV}'.")
     print("Here are the key results:")
@@ -950,7 +1311,8 @@ if __name__ == "__main__":
     # Show free water extraction results
     if 'clinical_group_fw_values' in final_df.columns:
         print("\nFree water extraction success:")
-        fw_success = final_df['clinical_group_fw_values'].notna() & (final_df['clinical_group_fw_values'] != 'Not reported')
+        fw_values = final_df['clinical_group_fw_values']
+        fw_success = fw_values.notna() & fw_values.ne('Not reported')
         print(f"{fw_success.sum()}/{len(final_df)} files had successful clinical FW value extraction")
         
     print(final_df[['filename', 'extraction_method', 'clinical_group_fw_values']].head())
\ No newline at end of file
@@ -8,9 +8,9 @@ import sys
 import subprocess
 
 def check_python_version():
-    """Check if Python version is 3.8 or higher."""
-    if sys.version_info < (3, 8):
-        print("❌ Error: Python 3.8 or higher is required")
+    """Check if Python version is 3.10 or higher."""
+    if sys.version_info < (3, 10):
+        print("❌ Error: Python 3.10 or higher is required")
         print(f"Current version: {sys.version}")
         return False
     print(f"✅ Python version: {sys.version}")
@@ -21,7 +21,7 @@ Usage:
     python systematic_review_ai.py
     
 Dependencies:
-    pip install anthropic openai google-generativeai PyMuPDF pandas tqdm python-dotenv
+    pip install anthropic openai google-generativeai PyMuPDF tqdm python-dotenv
 
 Environment Variables (recommended):
     ANTHROPIC_API_KEY=your_claude_api_key
@@ -31,41 +31,62 @@ Environment Variables (recommended):
 
 import os
 import sys
+import asyncio
+import contextlib
+import csv
+import functools
 import json
 import re
-import time
+import hashlib
+import importlib.util
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+from collections import Counter, deque
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple, Any
 
 # Third-party imports
 import fitz  # PyMuPDF for PDF processing
-import pandas as pd
 from tqdm import tqdm
 from dotenv import load_dotenv
 
-# AI Model imports (with graceful error handling)
+# orjson parses and serializes JSON several times faster; fall back to the stdlib if missing
 try:
-    import anthropic
-    ANTHROPIC_AVAILABLE = True
+    import orjson
+    ORJSON_AVAILABLE = True
 except ImportError:
-    ANTHROPIC_AVAILABLE = False
+    ORJSON_AVAILABLE = False
+
+# AI Model availability (with graceful error handling). Only the package of the model
+# chosen for the run is imported, in initialize_ai_client, so startup stays fast.
+def _package_installed(name: str) -> bool:
+    """Check whether a package can be imported, without importing it."""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except ModuleNotFoundError:  # Parent package (e.g. 'google') missing
+        return False
+
+ANTHROPIC_AVAILABLE = _package_installed('anthropic')
+if not ANTHROPIC_AVAILABLE:
     print("Warning: anthropic package not installed. Claude model will not be available.")
 
-try:
-    import openai
-    OPENAI_AVAILABLE = True
-except ImportError:
-    OPENAI_AVAILABLE = False
+OPENAI_AVAILABLE = _package_installed('openai')
+if not OPENAI_AVAILABLE:
     print("Warning: openai package not installed. OpenAI models will not be available.")
 
-try:
-    import google.generativeai as genai
-    GEMINI_AVAILABLE = True
-except ImportError:
-    GEMINI_AVAILABLE = False
+# tiktoken (optional) counts OpenAI tokens locally; without it OpenAI text is cut conservatively
+TIKTOKEN_AVAILABLE = _package_installed('tiktoken')
+
+GEMINI_AVAILABLE = _package_installed('google.generativeai')
+if not GEMINI_AVAILABLE:
     print("Warning: google-generativeai package not installed. Gemini model will not be available.")
 
+# h2 (optional) lets the Claude/OpenAI clients multiplex concurrent requests over HTTP/2
+HTTP2_AVAILABLE = _package_installed('h2')
+
 
 # ===========================================================================================
 # CONFIGURATION SECTION
@@ -80,7 +101,8 @@ class Config:
     # File and Directory Paths
     PDF_FOLDER = r'/home/uqahonne/git_arush/ai_systematic_review_tools/'  # Current directory
     OUTPUT_CSV = None  # Will be set based on model selection
-    PROGRESS_FILE = 'review_progress.json'
+    OUTPUT_COLUMNS = ['Filename', 'Title', 'Year', 'Decision', 'Justification']
+    PROGRESS_FILE = 'review_progress.jsonl'  # One JSON result per line, appended as files finish
     
     # File List Configuration
     USE_FILE_LIST = True
@@ -90,14 +112,61 @@ class Config:
     # Fallback list if file doesn't exist
     SPECIFIC_FILES_TO_PROCESS = []
     
-    # API Rate Limiting (seconds between requests)
-    RATE_LIMIT_DELAY = 5
+    # API Rate Limits per model: requests and input tokens per minute. Requests are sent as
+    # fast as both allow, so set these to your account's tier limits.
+    RATE_LIMITS = {
+        'claude': {'rpm': 50, 'tpm': 40000},
+        'openai': {'rpm': 500, 'tpm': 30000},
+        'gemini': {'rpm': 150, 'tpm': 2000000}
+    }
     
-    # Text Processing Limits (characters)
-    TEXT_LIMITS = {
-        'claude': 180000,    # Claude 3.5 Sonnet safe limit
-        'openai': 120000,    # GPT-4 safe limit  
-        'gemini': 1500000    # Gemini Pro safe limit
+    # Batch Mode (Claude/OpenAI): submit every remaining PDF as one Message Batches / Batch API
+    # job instead of one request per file. Billed at half price and not subject to per-minute
+    # limits, but results can take up to 24 hours.
+    USE_BATCH_API = False
+    BATCH_POLL_INTERVAL = 60  # Seconds between batch status checks
+    BATCH_REQUESTS_PATH = 'screening_batch_requests.jsonl'  # OpenAI batch input file
+    BATCH_STATE_PATH = 'screening_batch_state.json'  # Submitted batch ID, so a restarted run resumes it
+    # Larger runs are split into several jobs, submitted one after another, that stay under the
+    # provider's limits. For OpenAI, set the token limit to your tier's enqueued-token limit for the
+    # model; at about 4 characters per token it also keeps the input file well under 200 MB.
+    BATCH_MAX_REQUESTS = 10000
+    BATCH_MAX_TOKENS = {'claude': 50000000, 'openai': 2000000}
+    
+    # Concurrency: PDFs being processed at once. Requests still respect RATE_LIMITS, but a
+    # slow response no longer holds up the next paper.
+    MAX_CONCURRENT_REQUESTS = 8
+    
+    # HTTP Connection Pool (Claude/OpenAI): connections kept open and reused across requests
+    HTTP_MAX_CONNECTIONS = 16
+    
+    # Papers per Request (Claude/OpenAI): screen several papers in one request when the
+    # requests-per-minute limit is the bottleneck. Each paper then gets 1/N of the text limit;
+    # papers missing from a combined response are retried on their own. 1 = one per request.
+    PAPERS_PER_REQUEST = 1
+    
+    # PDF Extraction: dedicated threads reading PDFs, and how many PDFs may be extracted
+    # ahead of a free request slot, so text is ready when the next request can start
+    EXTRACTION_WORKERS = 4
+    EXTRACTION_PREFETCH = 8
+    
+    # Response Cache: decisions keyed on model, prompt and paper text, so reruns and
+    # duplicate papers skip the API call. Delete the file to start fresh.
+    USE_RESPONSE_CACHE = True
+    RESPONSE_CACHE_PATH = '.review_ai_cache.sqlite'
+    
+    # API Request Bounds: per-request timeout (seconds) and SDK retries on connection errors,
+    # 429s and 5xx, so a stuck request can't hold up the run; response length in tokens
+    REQUEST_TIMEOUT = 120
+    MAX_RETRIES = 3
+    MAX_OUTPUT_TOKENS = 400
+    
+    # Text Processing Limits (tokens of paper text, counted with each model's tokenizer;
+    # the context window minus room for the system prompt and the response)
+    TOKEN_LIMITS = {
+        'claude': 180000,    # Claude 3.5 Sonnet: 200k context
+        'openai': 120000,    # GPT-4o: 128k context
+        'gemini': 1500000    # Gemini 1.5 Pro: 2M context
     }
     
     # Model Versions
@@ -160,13 +229,28 @@ class PromptTemplates:
     - justification: a 2-3 sentence explanation for the decision
     '''
     
-    # Gemini Prompt Template
-    @staticmethod
-    def get_gemini_template():
-        return f'''
+    # Multi-Paper System Prompt (Config.PAPERS_PER_REQUEST > 1)
+    MULTI_PAPER_SYSTEM = f'''
     You are an expert assistant conducting a full-text review for a systematic review on Free Water diffusion MRI.
+    You will receive a JSON array of research papers, each with an "id" and its full "text".
+    Screen each paper independently against the specified criteria.
     
-    {PromptTemplates.CRITERIA}
+    {CRITERIA}
+    
+    Your response must ONLY be a single, valid JSON object with no additional text, explanations,
+    or markdown formatting. It must map every paper id to an object with exactly two keys:
+    - decision: either Include or Exclude
+    - justification: a 2-3 sentence explanation for the decision
+    
+    Example response:
+    {{"paper-0": {{"decision": "Exclude", "justification": "This is a review article rather than an original study."}}, "paper-1": {{"decision": "Include", "justification": "This peer-reviewed human study applies free-water modeling to diffusion MRI data."}}}}
+    '''
+    
+    # Gemini System Instruction (set once on the model, so each request sends only the paper)
+    GEMINI_SYSTEM = f'''
+    You are an expert assistant conducting a full-text review for a systematic review on Free Water diffusion MRI.
+    
+    {CRITERIA}
     
     Given the following full-text content, does this paper meet the inclusion criteria?
     Your entire response must be in JSON format with exactly two keys:
@@ -174,10 +258,13 @@ class PromptTemplates:
     - justification: a 2-3 sentence explanation for the decision
     
     Respond with valid JSON only, no additional text.
+    '''
     
+    # Gemini Per-Paper Prompt
+    GEMINI_PAPER = '''
     Here is the full text:
     ---
-    {{pdf_text}}
+    {pdf_text}
     ---
     '''
 
@@ -186,6 +273,23 @@ class PromptTemplates:
 # UTILITY FUNCTIONS
 # ===========================================================================================
 
+def json_loads(data: Any) -> Any:
+    """Parse JSON text or bytes, with orjson when installed (its errors subclass json.JSONDecodeError)."""
+    return orjson.loads(data) if ORJSON_AVAILABLE else json.loads(data)
+
+def json_dumps(obj: Any) -> bytes:
+    """Serialize to compact UTF-8 JSON bytes, with orjson when installed."""
+    return orjson.dumps(obj) if ORJSON_AVAILABLE else json.dumps(obj).encode('utf-8')
+
+# Candidate publication years (1980-2099), compiled once
+YEAR_PATTERN = re.compile(r'19[89]\d|20\d\d')
+
+# Markdown code fence Gemini sometimes wraps its JSON in
+GEMINI_FENCE_PATTERN = re.compile(r'\A\s*```(?:json)?\s*(.*?)\s*```\s*\Z', re.DOTALL)
+
+# Common header/footer text that rules a line out as the title
+TITLE_SKIP_PATTERN = re.compile(r'page|doi:|http|www\.|journal|volume|issue', re.IGNORECASE)
+
 def load_environment_variables() -> None:
     """Load environment variables from .env file if present."""
     load_dotenv()
@@ -245,7 +349,7 @@ def find_year_in_text(text: str) -> str:
     """
     current_year = datetime.now().year
     # Find 4-digit years between 1980 and current year + 1
-    years = re.findall(r'(19[89]\d|20\d\d)', text)
+    years = YEAR_PATTERN.findall(text)
     
     if years:
         # Convert to integers, filter for plausible years, return most recent
@@ -272,8 +376,7 @@ def extract_title_from_text(text: str) -> str:
         line = line.strip()
         if 10 <= len(line) <= 200 and not line.isupper() and len(line.split()) > 3:
             # Skip common headers/footers
-            skip_patterns = ['page', 'doi:', 'http', 'www.', 'journal', 'volume', 'issue']
-            if not any(pattern in line.lower() for pattern in skip_patterns):
+            if not TITLE_SKIP_PATTERN.search(line):
                 return line
     
     return "Title not found"
@@ -294,22 +397,16 @@ def extract_info_from_pdf(pdf_path: str) -> Tuple[Optional[str], str, str, str]:
         Tuple of (full_text, title, year, status_message)
     """
     try:
-        doc = fitz.open(pdf_path)
-        
-        # Extract metadata title first
-        title = doc.metadata.get('title', '').strip()
-        
-        # Extract full text
-        full_text = ""
-        first_page_text = ""
-        
-        for i, page in enumerate(doc):
-            page_text = page.get_text()
-            full_text += page_text
-            if i == 0:
-                first_page_text = page_text
+        # "with" closes the document even if a page fails to extract
+        with fitz.open(pdf_path) as doc:
+            # Extract metadata title first
+            title = (doc.metadata.get('title') or '').strip()
+            
+            # Extract full text, collecting the pages and joining once
+            page_texts = [page.get_text() for page in doc]
         
-        doc.close()
+        full_text = "".join(page_texts)
+        first_page_text = page_texts[0] if page_texts else ""
         
         # If no metadata title, try to extract from first page
         if not title or title.lower() in ['untitled', 'title not found']:
@@ -332,24 +429,119 @@ def extract_info_from_pdf(pdf_path: str) -> Tuple[Optional[str], str, str, str]:
 # AI MODEL INTERFACE FUNCTIONS
 # ===========================================================================================
 
-def analyze_text_with_claude(text: str, client: Any) -> Dict[str, str]:
+@functools.lru_cache(maxsize=1)
+def openai_encoding() -> Any:
+    """tiktoken encoding for the configured OpenAI model, loaded once."""
+    import tiktoken
+    try:
+        return tiktoken.encoding_for_model(Config.MODEL_VERSIONS['openai'])
+    except KeyError:
+        return tiktoken.get_encoding('o200k_base')
+
+async def count_text_tokens(text: str, ai_client: Any, model_name: str) -> int:
+    """Count the tokens in text with the model's own tokenizer (Claude and Gemini)."""
+    if model_name == 'claude':
+        response = await ai_client.messages.count_tokens(
+            model=Config.MODEL_VERSIONS['claude'],
+            messages=[{"role": "user", "content": text}]
+        )
+        return response.input_tokens
+    if model_name == 'gemini':
+        return (await ai_client.count_tokens_async(text)).total_tokens
+    raise ValueError(f"Unknown model: {model_name}")
+
+async def truncate_to_tokens(text: str, ai_client: Any, model_name: str, max_tokens: Optional[int] = None) -> str:
+    """
+    Cut text to at most max_tokens tokens of the model's tokenizer.
+    
+    Args:
+        text: Full text content from PDF
+        ai_client: Initialized AI client (used to count Claude and Gemini tokens)
+        model_name: Name of the AI model being used
+        max_tokens: Token budget (default: Config.TOKEN_LIMITS for the model)
+        
+    Returns:
+        The longest prefix of text that fits the budget
+    """
+    max_tokens = max_tokens or Config.TOKEN_LIMITS[model_name]
+    # Fewer than 2 characters per token does not happen in practice, so short texts are never counted
+    if len(text) <= max_tokens * 2:
+        return text
+    
+    if model_name == 'openai':
+        if not TIKTOKEN_AVAILABLE:
+            return text[:max_tokens * 3]
+        encoding = openai_encoding()
+        return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+    
+    try:
+        # The characters-per-token ratio measured on this text sizes each cut, so few counts are needed
+        for _ in range(5):
+            tokens = await count_text_tokens(text, ai_client, model_name)
+            if tokens <= max_tokens:
+                return text
+            text = text[:int(len(text) * max_tokens / tokens * 0.98)]
+    except Exception as e:
+        print(f"Warning: Could not count tokens, truncating by characters: {e}")
+    return text[:max_tokens * 3]
+
+def parse_decision(response_text: str, source: str) -> Dict[str, str]:
+    """
+    Parse and validate the JSON decision returned by a model.
+    
+    Args:
+        response_text: Raw response text
+        source: Model name used in error messages
+        
+    Returns:
+        Dictionary with 'decision' and 'justification' keys
+    """
+    try:
+        result = json_loads(response_text)
+    except json.JSONDecodeError as e:
+        return {"decision": "JSON Error", "justification": f"Invalid JSON response from {source}: {str(e)}"}
+    return validate_decision(result)
+
+def validate_decision(result: Any) -> Dict[str, str]:
+    """
+    Check that a parsed model response is a valid decision.
+    
+    Args:
+        result: Parsed JSON response
+        
+    Returns:
+        The response, or an error dictionary with 'decision' and 'justification' keys
+    """
+    # Validate required keys
+    if not isinstance(result, dict):
+        return {"decision": "Parse Error", "justification": "Model response is not a JSON object"}
+    if 'decision' not in result or 'justification' not in result:
+        return {"decision": "Parse Error", "justification": "Missing required keys in model response"}
+    
+    # Validate decision value
+    if result['decision'] not in ['Include', 'Exclude']:
+        return {"decision": "Parse Error", "justification": f"Invalid decision value: {result['decision']}"}
+    
+    return result
+
+async def analyze_text_with_claude(text: str, client: Any) -> Dict[str, str]:
     """
     Analyze text using Anthropic's Claude model.
     
     Args:
         text: Full text content from PDF
-        client: Anthropic client instance
+        client: AsyncAnthropic client instance
         
     Returns:
         Dictionary with 'decision' and 'justification' keys
     """
     try:
         # Truncate text to safe limit
-        truncated_text = text[:Config.TEXT_LIMITS['claude']]
+        truncated_text = await truncate_to_tokens(text, client, 'claude')
         
-        response = client.messages.create(
+        response = await client.messages.create(
             model=Config.MODEL_VERSIONS['claude'],
-            max_tokens=400,
+            max_tokens=Config.MAX_OUTPUT_TOKENS,
             system=PromptTemplates.CLAUDE_SYSTEM,
             messages=[
                 {
@@ -359,112 +551,481 @@ def analyze_text_with_claude(text: str, client: Any) -> Dict[str, str]:
             ]
         )
         
-        # Parse JSON response
-        result = json.loads(response.content[0].text)
-        
-        # Validate required keys
-        if 'decision' not in result or 'justification' not in result:
-            return {"decision": "Parse Error", "justification": "Missing required keys in model response"}
+        return parse_decision(response.content[0].text, "Claude")
         
-        # Validate decision value
-        if result['decision'] not in ['Include', 'Exclude']:
-            return {"decision": "Parse Error", "justification": f"Invalid decision value: {result['decision']}"}
-        
-        return result
-        
-    except json.JSONDecodeError as e:
-        return {"decision": "JSON Error", "justification": f"Invalid JSON response from Claude: {str(e)}"}
     except Exception as e:
         return {"decision": "API Error", "justification": f"Claude API error: {str(e)}"}
 
-def analyze_text_with_openai(text: str, client: Any) -> Dict[str, str]:
+async def analyze_text_with_openai(text: str, client: Any) -> Dict[str, str]:
     """
     Analyze text using OpenAI's GPT model.
     
     Args:
         text: Full text content from PDF
-        client: OpenAI client instance
+        client: AsyncOpenAI client instance
         
     Returns:
         Dictionary with 'decision' and 'justification' keys
     """
     try:
         # Truncate text to safe limit
-        truncated_text = text[:Config.TEXT_LIMITS['openai']]
+        truncated_text = await truncate_to_tokens(text, client, 'openai')
         
-        response = client.chat.completions.create(
+        response = await client.chat.completions.create(
             model=Config.MODEL_VERSIONS['openai'],
             messages=[
                 {"role": "system", "content": PromptTemplates.OPENAI_SYSTEM},
                 {"role": "user", "content": truncated_text}
             ],
             response_format={"type": "json_object"},
+            max_tokens=Config.MAX_OUTPUT_TOKENS,
             temperature=0
         )
         
-        # Parse JSON response
-        result = json.loads(response.choices[0].message.content)
-        
-        # Validate required keys
-        if 'decision' not in result or 'justification' not in result:
-            return {"decision": "Parse Error", "justification": "Missing required keys in model response"}
+        return parse_decision(response.choices[0].message.content, "OpenAI")
         
-        # Validate decision value
-        if result['decision'] not in ['Include', 'Exclude']:
-            return {"decision": "Parse Error", "justification": f"Invalid decision value: {result['decision']}"}
-        
-        return result
-        
-    except json.JSONDecodeError as e:
-        return {"decision": "JSON Error", "justification": f"Invalid JSON response from OpenAI: {str(e)}"}
     except Exception as e:
         return {"decision": "API Error", "justification": f"OpenAI API error: {str(e)}"}
 
-def analyze_text_with_gemini(text: str, model: Any) -> Dict[str, str]:
+async def analyze_text_with_gemini(text: str, model: Any) -> Dict[str, str]:
     """
     Analyze text using Google's Gemini model.
     
     Args:
         text: Full text content from PDF
-        model: Gemini model instance
+        model: Gemini model instance, configured with the system instruction
         
     Returns:
         Dictionary with 'decision' and 'justification' keys
     """
-    prompt = PromptTemplates.get_gemini_template().format(pdf_text=text[:1_500_000])
     try:
-        response = model.generate_content(prompt)
-        cleaned_response_text = response.text.strip().lstrip('```json').rstrip('```')
-        return json.loads(cleaned_response_text)
+        prompt = PromptTemplates.GEMINI_PAPER.format(pdf_text=await truncate_to_tokens(text, model, 'gemini'))
+        response = await model.generate_content_async(prompt,
+                                                      request_options={"timeout": Config.REQUEST_TIMEOUT})
+        fenced = GEMINI_FENCE_PATTERN.match(response.text)
+        return parse_decision(fenced.group(1) if fenced else response.text.strip(), "Gemini")
     except Exception as e:
         return {"decision": "API Error", "justification": str(e)}
 
+TEXT_ANALYZERS = {
+    'claude': analyze_text_with_claude,
+    'openai': analyze_text_with_openai,
+    'gemini': analyze_text_with_gemini
+}
+
+async def analyze_text(text: str, ai_client: Any, model_name: str) -> Dict[str, str]:
+    """
+    Analyze text with the selected AI model.
+    
+    Args:
+        text: Full text content from PDF
+        ai_client: Initialized AI client
+        model_name: Name of the AI model being used
+        
+    Returns:
+        Dictionary with 'decision' and 'justification' keys
+    """
+    analyzer = TEXT_ANALYZERS.get(model_name)
+    if analyzer is None:
+        return {"decision": "Model Error", "justification": f"Unknown model: {model_name}"}
+    return await analyzer(text, ai_client)
+
+async def analyze_texts_packed(texts: Dict[str, str], client: Any, model_name: str) -> Dict[str, Dict[str, str]]:
+    """
+    Analyze several texts in a single Claude or OpenAI request.
+    
+    Args:
+        texts: Map of paper ID -> full text content from PDF
+        client: AsyncAnthropic or AsyncOpenAI client instance
+        model_name: 'claude' or 'openai'
+        
+    Returns:
+        Map of paper ID -> valid decision. Papers missing from the response, or with an
+        invalid decision, are left out so the caller can retry them individually.
+    """
+    per_paper_limit = Config.TOKEN_LIMITS[model_name] // len(texts)
+    try:
+        content = json_dumps([
+            {"id": paper_id, "text": await truncate_to_tokens(text, client, model_name, per_paper_limit)}
+            for paper_id, text in texts.items()
+        ]).decode('utf-8')
+        if model_name == 'claude':
+            response = await client.messages.create(
+                model=Config.MODEL_VERSIONS['claude'],
+                max_tokens=Config.MAX_OUTPUT_TOKENS * len(texts),
+                system=PromptTemplates.MULTI_PAPER_SYSTEM,
+                messages=[{"role": "user", "content": content}]
+            )
+            decisions = json_loads(response.content[0].text)
+        else:
+            response = await client.chat.completions.create(
+                model=Config.MODEL_VERSIONS['openai'],
+                messages=[
+                    {"role": "system", "content": PromptTemplates.MULTI_PAPER_SYSTEM},
+                    {"role": "user", "content": content}
+                ],
+                response_format={"type": "json_object"},
+                max_tokens=Config.MAX_OUTPUT_TOKENS * len(texts),
+                temperature=0
+            )
+            decisions = json_loads(response.choices[0].message.content)
+    except Exception as e:
+        print(f"Warning: Combined request failed, retrying papers individually: {e}")
+        return {}
+    
+    if not isinstance(decisions, dict):
+        return {}
+    results = {}
+    for paper_id in texts:
+        result = validate_decision(decisions.get(paper_id))
+        if result['decision'] in ('Include', 'Exclude'):
+            results[paper_id] = result
+    return results
+
 
 # ===========================================================================================
-# PROGRESS TRACKING FUNCTIONS
+# BATCH API FUNCTIONS
 # ===========================================================================================
 
-def save_progress(results_list: List[Dict], progress_file: str = Config.PROGRESS_FILE) -> None:
+async def submit_batch_to_claude(texts: Dict[str, str], client: Any) -> str:
     """
-    Save current progress to JSON file.
+    Submit many texts as one Anthropic Message Batches job.
     
     Args:
-        results_list: List of processing results
-        progress_file: Path to progress file
+        texts: Map of request ID -> full text content from PDF
+        client: AsyncAnthropic client instance
+        
+    Returns:
+        ID of the submitted batch
+    """
+    batch = await client.messages.batches.create(requests=[
+        {
+            "custom_id": request_id,
+            "params": {
+                "model": Config.MODEL_VERSIONS['claude'],
+                "max_tokens": Config.MAX_OUTPUT_TOKENS,
+                "system": PromptTemplates.CLAUDE_SYSTEM,
+                "messages": [{"role": "user", "content": await truncate_to_tokens(text, client, 'claude')}]
+            }
+        }
+        for request_id, text in texts.items()
+    ])
+    print(f"📦 Submitted Claude batch {batch.id} with {len(texts)} request(s)")
+    return batch.id
+
+async def collect_batch_from_claude(batch_id: str, client: Any) -> Dict[str, Dict[str, str]]:
+    """
+    Wait for an Anthropic Message Batches job to end and read its results.
+    
+    Args:
+        batch_id: ID of the submitted batch
+        client: AsyncAnthropic client instance
+        
+    Returns:
+        Map of request ID -> dictionary with 'decision' and 'justification' keys
+    """
+    print(f"⏳ Waiting for Claude batch {batch_id} to complete...")
+    batch = await client.messages.batches.retrieve(batch_id)
+    while batch.processing_status != 'ended':
+        await asyncio.sleep(Config.BATCH_POLL_INTERVAL)
+        batch = await client.messages.batches.retrieve(batch.id)
+        print(f"   Batch status: {batch.processing_status} ({batch.request_counts.succeeded} succeeded)")
+    
+    results = {}
+    async for entry in await client.messages.batches.results(batch.id):
+        if entry.result.type == 'succeeded':
+            results[entry.custom_id] = parse_decision(entry.result.message.content[0].text, "Claude")
+        elif entry.result.type in ('expired', 'canceled'):
+            continue  # Never processed; left without a result so it is submitted again
+        else:
+            results[entry.custom_id] = {"decision": "API Error",
+                                        "justification": f"Claude batch request {entry.result.type}"}
+    return results
+
+async def submit_batch_to_openai(texts: Dict[str, str], client: Any) -> str:
+    """
+    Submit many texts as one OpenAI Batch API job.
+    
+    Args:
+        texts: Map of request ID -> full text content from PDF
+        client: AsyncOpenAI client instance
+        
+    Returns:
+        ID of the submitted batch
+    """
+    with open(Config.BATCH_REQUESTS_PATH, 'wb') as f:
+        for request_id, text in texts.items():
+            f.write(json_dumps({
+                "custom_id": request_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": Config.MODEL_VERSIONS['openai'],
+                    "messages": [
+                        {"role": "system", "content": PromptTemplates.OPENAI_SYSTEM},
+                        {"role": "user", "content": await truncate_to_tokens(text, client, 'openai')}
+                    ],
+                    "response_format": {"type": "json_object"},
+                    "max_tokens": Config.MAX_OUTPUT_TOKENS,
+                    "temperature": 0
+                }
+            }) + b"\n")
+    
+    with open(Config.BATCH_REQUESTS_PATH, 'rb') as f:
+        input_file = await client.files.create(file=f, purpose="batch")
+    batch = await client.batches.create(input_file_id=input_file.id, endpoint="/v1/chat/completions",
+                                        completion_window="24h")
+    print(f"📦 Submitted OpenAI batch {batch.id} with {len(texts)} request(s)")
+    return batch.id
+
+async def collect_batch_from_openai(batch_id: str, client: Any) -> Dict[str, Dict[str, str]]:
+    """
+    Wait for an OpenAI Batch API job to finish and read its results.
+    
+    Requests that failed are listed in the batch's error file rather than its output
+    file, so both are read.
+    
+    Args:
+        batch_id: ID of the submitted batch
+        client: AsyncOpenAI client instance
+        
+    Returns:
+        Map of request ID -> dictionary with 'decision' and 'justification' keys
+    """
+    print(f"⏳ Waiting for OpenAI batch {batch_id} to complete...")
+    batch = await client.batches.retrieve(batch_id)
+    while batch.status not in ('completed', 'failed', 'expired', 'cancelled'):
+        await asyncio.sleep(Config.BATCH_POLL_INTERVAL)
+        batch = await client.batches.retrieve(batch_id)
+        print(f"   Batch status: {batch.status}")
+    
+    if batch.status != 'completed':
+        print(f"⚠️ OpenAI batch {batch_id} {batch.status}: {batch.errors}")
+    
+    results = {}
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        output = await client.files.content(file_id)
+        for line in output.text.splitlines():
+            if not line.strip():
+                continue
+            row = json_loads(line)
+            response = row.get('response') or {}
+            if response.get('status_code') == 200:
+                content = response['body']['choices'][0]['message']['content']
+                results[row['custom_id']] = parse_decision(content, "OpenAI")
+            else:
+                error = row.get('error') or (response.get('body') or {}).get('error')
+                results[row['custom_id']] = {"decision": "API Error",
+                                             "justification": f"OpenAI batch request failed: {error}"}
+    return results
+
+# Model name -> (submit, collect) pair for Batch Mode
+BATCH_ANALYZERS = {
+    'claude': (submit_batch_to_claude, collect_batch_from_claude),
+    'openai': (submit_batch_to_openai, collect_batch_from_openai)
+}
+
+def split_batch_requests(papers: List[Tuple], model_name: str) -> List[List[Tuple]]:
+    """
+    Split papers into batch jobs within Config.BATCH_MAX_REQUESTS and Config.BATCH_MAX_TOKENS.
+    
+    Args:
+        papers: (filename, title, year, text, cache_key) tuples to screen
+        model_name: Name of the AI model being used
+        
+    Returns:
+        One list of papers per batch job
+    """
+    max_tokens = Config.BATCH_MAX_TOKENS[model_name]
+    jobs, current, current_tokens = [], [], 0
+    for paper in papers:
+        tokens = estimate_tokens(paper[3], Config.TOKEN_LIMITS[model_name]) + Config.MAX_OUTPUT_TOKENS
+        if current and (len(current) >= Config.BATCH_MAX_REQUESTS or current_tokens + tokens > max_tokens):
+            jobs.append(current)
+            current, current_tokens = [], 0
+        current.append(paper)
+        current_tokens += tokens
+    if current:
+        jobs.append(current)
+    return jobs
+
+def save_batch_state(model_name: str, batch_id: str, requests: Dict[str, str]) -> None:
     """
+    Record a submitted batch so a restarted run can resume it instead of submitting again.
+    
+    Args:
+        model_name: Name of the AI model the batch was submitted to
+        batch_id: ID of the submitted batch
+        requests: Map of request ID -> PDF filename
+    """
+    with open(Config.BATCH_STATE_PATH, 'wb') as f:
+        f.write(json_dumps({'model': model_name, 'batch_id': batch_id, 'requests': requests}))
+
+def load_batch_state(model_name: str) -> Optional[Dict[str, Any]]:
+    """
+    Load the batch left unfinished by an earlier run, if it was submitted to this model.
+    
+    Args:
+        model_name: Name of the AI model being used
+        
+    Returns:
+        Dictionary with 'batch_id' and 'requests' keys, or None
+    """
+    if not os.path.exists(Config.BATCH_STATE_PATH):
+        return None
     try:
-        with open(progress_file, 'w') as f:
-            json.dump({
-                'timestamp': datetime.now().isoformat(),
-                'processed_count': len(results_list),
-                'results': results_list
-            }, f, indent=2)
+        with open(Config.BATCH_STATE_PATH, 'rb') as f:
+            state = json_loads(f.read())
     except Exception as e:
-        print(f"Warning: Could not save progress: {e}")
+        print(f"Warning: Could not read batch state file: {e}")
+        return None
+    return state if state.get('model') == model_name else None
+
+
+# ===========================================================================================
+# RESPONSE CACHE
+# ===========================================================================================
+
+class ResponseCache:
+    """Persistent map of content hash -> AI decision, backed by SQLite."""
+    
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path)
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL)")
+    
+    def get(self, key: str) -> Optional[Dict[str, str]]:
+        row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        return json_loads(row[0]) if row else None
+    
+    def set(self, key: str, result: Dict[str, str]) -> None:
+        with self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO responses (key, response) VALUES (?, ?)",
+                               (key, json_dumps(result).decode('utf-8')))
+    
+    def close(self) -> None:
+        self._conn.close()
+
+def response_cache_key(text: str, model_name: str, packed_token_limit: Optional[int] = None) -> str:
+    """
+    Build the cache key for one analysis.
+    
+    Args:
+        text: Full text content from PDF
+        model_name: Name of the AI model being used
+        packed_token_limit: Per-paper token budget when the paper was screened in a combined
+            request (Config.PAPERS_PER_REQUEST), so decisions made on cut-down text are kept
+            apart from single-paper ones
+        
+    Returns:
+        SHA-256 hex digest of the model, its prompt and text limit, and the paper text
+    """
+    prompts = {
+        'claude': PromptTemplates.CLAUDE_SYSTEM,
+        'openai': PromptTemplates.OPENAI_SYSTEM,
+        'gemini': PromptTemplates.GEMINI_SYSTEM + PromptTemplates.GEMINI_PAPER
+    }
+    if packed_token_limit:
+        prompt, token_limit = PromptTemplates.MULTI_PAPER_SYSTEM, packed_token_limit
+    else:
+        prompt, token_limit = prompts.get(model_name), Config.TOKEN_LIMITS.get(model_name)
+    digest = hashlib.sha256(json.dumps([
+        model_name,
+        Config.MODEL_VERSIONS.get(model_name),
+        prompt,
+        token_limit
+    ]).encode('utf-8'))
+    digest.update(text.encode('utf-8', errors='replace'))
+    return digest.hexdigest()
+
+
+class RateLimiter:
+    """
+    Sliding-window limiter for requests per minute and input tokens per minute.
+    
+    Each request waits only until both one-minute windows have room for it, instead of
+    a fixed delay between requests.
+    """
+    
+    WINDOW = 60.0
+    
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests: deque = deque()  # (start time, estimated tokens)
+        self._tokens = 0
+    
+    async def acquire(self, tokens: int) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            while self._requests and self._requests[0][0] <= now - self.WINDOW:
+                self._tokens -= self._requests.popleft()[1]
+            # A request larger than the whole token budget is let through once the window is empty
+            if not self._requests or (len(self._requests) < self.rpm and self._tokens + tokens <= self.tpm):
+                self._requests.append((now, tokens))
+                self._tokens += tokens
+                return
+            await asyncio.sleep(self._requests[0][0] + self.WINDOW - now)
+
+
+def estimate_tokens(text: str, max_tokens: int) -> int:
+    """Rough input token count (about 4 characters per token, capped at the budget) for rate limiting."""
+    return min(len(text) // 4, max_tokens) + 500
+
+
+# ===========================================================================================
+# PROGRESS TRACKING FUNCTIONS
+# ===========================================================================================
+
+def append_result(result: Dict, progress_fp: Any) -> None:
+    """
+    Append one result to the JSONL progress file and flush it to disk.
+    
+    Args:
+        result: Processing result for a single PDF
+        progress_fp: Progress file opened in binary append mode
+    """
+    progress_fp.write(json_dumps(result) + b"\n")
+    progress_fp.flush()
+    os.fsync(progress_fp.fileno())
+
+class ProgressWriter(threading.Thread):
+    """
+    Background thread that appends results put on its queue to the progress file.
+    
+    Keeps the per-result fsync off the processing loop. Put None on the queue to
+    stop the thread once every queued result has been written.
+    """
+    
+    def __init__(self, progress_file: str = Config.PROGRESS_FILE):
+        super().__init__(daemon=True)
+        self.progress_file = progress_file
+        self.queue: queue.Queue = queue.Queue()
+    
+    def run(self) -> None:
+        with open(self.progress_file, 'a+b') as f:
+            # A run killed mid-write can leave a partial last line; start on a fresh one
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+            while (result := self.queue.get()) is not None:
+                try:
+                    append_result(result, f)
+                except Exception as e:
+                    print(f"Warning: Could not save progress: {e}")
+    
+    def close(self) -> None:
+        """Write any pending results and stop the thread."""
+        self.queue.put(None)
+        self.join()
 
 def load_progress(progress_file: str = Config.PROGRESS_FILE) -> List[Dict]:
     """
-    Load previous progress from JSON file.
+    Load previous progress from the JSONL progress file.
     
     Args:
         progress_file: Path to progress file
@@ -473,15 +1034,70 @@ def load_progress(progress_file: str = Config.PROGRESS_FILE) -> List[Dict]:
         List of previously processed results
     """
     if not os.path.exists(progress_file):
+        return migrate_legacy_progress(progress_file)
+    
+    results = []
+    with open(progress_file, 'rb') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                results.append(json_loads(line))
+            except json.JSONDecodeError as e:
+                # Partial line from a run killed mid-write; that file is simply processed again
+                print(f"Warning: Skipping unreadable progress line: {e}")
+    return results
+
+def migrate_legacy_progress(progress_file: str = Config.PROGRESS_FILE) -> List[Dict]:
+    """
+    Carry results over from the old single-JSON progress file (review_progress.json).
+    
+    Earlier versions rewrote one JSON document holding a 'results' list. When only that
+    file exists, its results are copied into the JSONL progress file once, so an
+    interrupted run started with an older version still resumes where it stopped.
+    
+    Args:
+        progress_file: Path to the JSONL progress file
+        
+    Returns:
+        List of previously processed results, empty if there is no old file
+    """
+    legacy_file = os.path.splitext(progress_file)[0] + '.json'
+    if legacy_file == progress_file or not os.path.exists(legacy_file):
         return []
     
     try:
-        with open(progress_file, 'r') as f:
-            data = json.load(f)
-            return data.get('results', [])
+        with open(legacy_file, 'rb') as f:
+            results = json_loads(f.read()).get('results', [])
+        with open(progress_file, 'wb') as f:
+            for result in results:
+                f.write(json_dumps(result) + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
     except Exception as e:
-        print(f"Warning: Could not load progress file: {e}")
+        print(f"Warning: Could not migrate old progress file {legacy_file}: {e}")
         return []
+    
+    print(f"📂 Migrated {len(results)} results from {legacy_file} to {progress_file}")
+    return results
+
+def drop_failed_results(results_list: List[Dict]) -> List[Dict]:
+    """
+    Drop results without an Include/Exclude decision, so those files are processed again.
+    
+    API, parse, extraction and missing-file errors are often transient (rate limits,
+    timeouts), so they are retried on the next run instead of being kept for good.
+    
+    Args:
+        results_list: List of processing results
+        
+    Returns:
+        Results with a real decision
+    """
+    decided = [result for result in results_list if result.get('Decision') in ('Include', 'Exclude')]
+    if len(decided) < len(results_list):
+        print(f"🔁 {len(results_list) - len(decided)} previously failed result(s) will be retried")
+    return decided
 
 def get_processed_filenames(results_list: List[Dict]) -> set:
     """
@@ -502,7 +1118,7 @@ def get_processed_filenames(results_list: List[Dict]) -> set:
 
 def initialize_ai_client(model_name: str) -> Optional[Any]:
     """
-    Initialize the AI client for the specified model.
+    Initialize the (asynchronous) AI client for the specified model.
     
     Args:
         model_name: Name of the AI model ('claude', 'openai', 'gemini')
@@ -520,7 +1136,12 @@ def initialize_ai_client(model_name: str) -> Optional[Any]:
             if not ANTHROPIC_AVAILABLE:
                 print("Error: anthropic package not installed")
                 return None
-            client = anthropic.Anthropic(api_key=api_key)
+            import anthropic
+            import httpx
+            http_client = anthropic.DefaultAsyncHttpxClient(http2=HTTP2_AVAILABLE, limits=httpx.Limits(
+                max_connections=Config.HTTP_MAX_CONNECTIONS, max_keepalive_connections=Config.HTTP_MAX_CONNECTIONS))
+            client = anthropic.AsyncAnthropic(api_key=api_key, timeout=Config.REQUEST_TIMEOUT,
+                                             max_retries=Config.MAX_RETRIES, http_client=http_client)
             print("✅ Claude (Anthropic) API configured successfully")
             return client
             
@@ -528,7 +1149,12 @@ def initialize_ai_client(model_name: str) -> Optional[Any]:
             if not OPENAI_AVAILABLE:
                 print("Error: openai package not installed")
                 return None
-            client = openai.OpenAI(api_key=api_key)
+            import openai
+            import httpx
+            http_client = openai.DefaultAsyncHttpxClient(http2=HTTP2_AVAILABLE, limits=httpx.Limits(
+                max_connections=Config.HTTP_MAX_CONNECTIONS, max_keepalive_connections=Config.HTTP_MAX_CONNECTIONS))
+            client = openai.AsyncOpenAI(api_key=api_key, timeout=Config.REQUEST_TIMEOUT,
+                                       max_retries=Config.MAX_RETRIES, http_client=http_client)
             print("✅ OpenAI API configured successfully")
             return client
             
@@ -536,8 +1162,12 @@ def initialize_ai_client(model_name: str) -> Optional[Any]:
             if not GEMINI_AVAILABLE:
                 print("Error: google-generativeai package not installed")
                 return None
+            import google.generativeai as genai
             genai.configure(api_key=api_key)
-            model = genai.GenerativeModel(Config.MODEL_VERSIONS['gemini'])
+            model = genai.GenerativeModel(Config.MODEL_VERSIONS['gemini'],
+                                          system_instruction=PromptTemplates.GEMINI_SYSTEM,
+                                          generation_config={"max_output_tokens": Config.MAX_OUTPUT_TOKENS,
+                                                             "temperature": 0})
             print("✅ Gemini API configured successfully")
             return model
             
@@ -549,6 +1179,27 @@ def initialize_ai_client(model_name: str) -> Optional[Any]:
         print(f"Error: Failed to configure {model_name} API: {e}")
         return None
 
+def list_folder_files(folder: str) -> List[str]:
+    """Names of the files in a folder, from a single directory scan (no per-file stat calls)."""
+    with os.scandir(folder) as entries:
+        return [entry.name for entry in entries if entry.is_file()]
+
+def pdf_exists(filename: str, pdf_folder: str, folder_files: Optional[set] = None) -> bool:
+    """
+    Check whether a PDF exists, using the folder listing when one is available.
+    
+    Args:
+        filename: Name of the PDF file (may include a subfolder)
+        pdf_folder: Path to folder containing PDFs
+        folder_files: Optional set of names from list_folder_files(pdf_folder)
+        
+    Returns:
+        True if the file exists
+    """
+    if folder_files is not None and os.path.basename(filename) == filename:
+        return filename in folder_files
+    return os.path.exists(os.path.join(pdf_folder, filename))
+
 def get_files_to_process(pdf_folder: str, specific_files: List[str]) -> List[str]:
     """
     Get list of PDF files to process.
@@ -564,15 +1215,40 @@ def get_files_to_process(pdf_folder: str, specific_files: List[str]) -> List[str
         print(f"📂 Specific file mode: Processing {len(specific_files)} specified files")
         return specific_files
     else:
-        all_pdfs = [f for f in os.listdir(pdf_folder) if f.lower().endswith('.pdf')]
+        all_pdfs = [f for f in list_folder_files(pdf_folder) if f.lower().endswith('.pdf')]
         print(f"📂 Full folder mode: Processing all {len(all_pdfs)} PDFs found")
         return all_pdfs
 
-def process_single_pdf(
+def result_row(filename: str, title: str, year: str, analysis_result: Dict[str, str]) -> Dict[str, str]:
+    """Build the output row for one PDF from its metadata and analysis result."""
+    return {
+        'Filename': filename,
+        'Title': title,
+        'Year': year,
+        'Decision': analysis_result.get('decision', 'Parse Error'),
+        'Justification': analysis_result.get('justification', 'Could not parse model response')
+    }
+
+def missing_file_row(filename: str, pdf_folder: str) -> Dict[str, str]:
+    """Build the output row for a PDF that does not exist."""
+    return {
+        'Filename': filename,
+        'Title': 'File Not Found',
+        'Year': 'Error',
+        'Decision': 'File Error',
+        'Justification': f'File {filename} not found in {pdf_folder}'
+    }
+
+async def process_single_pdf(
     filename: str, 
     pdf_folder: str, 
     ai_client: Any, 
-    model_name: str
+    model_name: str,
+    cache: Optional[ResponseCache] = None,
+    rate_limiter: Optional[RateLimiter] = None,
+    extractor: Optional[Executor] = None,
+    request_slots: Optional[asyncio.Semaphore] = None,
+    folder_files: Optional[set] = None
 ) -> Dict[str, str]:
     """
     Process a single PDF file.
@@ -582,6 +1258,12 @@ def process_single_pdf(
         pdf_folder: Path to folder containing PDFs
         ai_client: Initialized AI client
         model_name: Name of the AI model being used
+        cache: Optional response cache checked before calling the AI model
+        rate_limiter: Optional rate limiter acquired before each API request
+        extractor: Executor for PDF extraction (default: the event loop's executor)
+        request_slots: Optional semaphore held only while the AI model is called, so
+            extraction of later PDFs can run ahead of the requests
+        folder_files: Optional set of file names in pdf_folder, to skip per-file existence checks
         
     Returns:
         Dictionary with processing results
@@ -589,38 +1271,266 @@ def process_single_pdf(
     pdf_path = os.path.join(pdf_folder, filename)
     
     # Check if file exists
-    if not os.path.exists(pdf_path):
-        return {
-            'Filename': filename,
-            'Title': 'File Not Found',
-            'Year': 'Error',
-            'Decision': 'File Error',
-            'Justification': f'File {filename} not found in {pdf_folder}'
-        }
+    if not pdf_exists(filename, pdf_folder, folder_files):
+        return missing_file_row(filename, pdf_folder)
     
-    # Extract text and metadata from PDF
-    pdf_text, title, year, status = extract_info_from_pdf(pdf_path)
+    # Extract text and metadata from PDF (CPU-bound, so off the event loop)
+    loop = asyncio.get_running_loop()
+    pdf_text, title, year, status = await loop.run_in_executor(extractor, extract_info_from_pdf, pdf_path)
     
     # Analyze with AI if text extraction was successful
-    if pdf_text:
-        if model_name == 'claude':
-            analysis_result = analyze_text_with_claude(pdf_text, ai_client)
-        elif model_name == 'openai':
-            analysis_result = analyze_text_with_openai(pdf_text, ai_client)
-        elif model_name == 'gemini':
-            analysis_result = analyze_text_with_gemini(pdf_text, ai_client)
-        else:
-            analysis_result = {"decision": "Model Error", "justification": f"Unknown model: {model_name}"}
+    cache_key = response_cache_key(pdf_text, model_name) if pdf_text and cache else None
+    cached_result = cache.get(cache_key) if cache_key else None
+    if cached_result:
+        analysis_result = cached_result
+    elif pdf_text:
+        async with request_slots or contextlib.nullcontext():
+            if rate_limiter:
+                await rate_limiter.acquire(estimate_tokens(pdf_text, Config.TOKEN_LIMITS[model_name]))
+            analysis_result = await analyze_text(pdf_text, ai_client, model_name)
+        # Only real decisions are cached; errors are retried on the next run (drop_failed_results)
+        if cache_key and analysis_result.get('decision') in ('Include', 'Exclude'):
+            cache.set(cache_key, analysis_result)
     else:
         analysis_result = {"decision": "Extraction Error", "justification": status}
     
-    return {
-        'Filename': filename,
-        'Title': title,
-        'Year': year,
-        'Decision': analysis_result.get('decision', 'Parse Error'),
-        'Justification': analysis_result.get('justification', 'Could not parse model response')
-    }
+    return result_row(filename, title, year, analysis_result)
+
+async def process_pdf_group(
+    filenames: List[str],
+    pdf_folder: str,
+    ai_client: Any,
+    model_name: str,
+    cache: Optional[ResponseCache] = None,
+    rate_limiter: Optional[RateLimiter] = None,
+    extractor: Optional[Executor] = None,
+    request_slots: Optional[asyncio.Semaphore] = None,
+    folder_files: Optional[set] = None
+) -> List[Dict[str, str]]:
+    """
+    Process several PDF files with one combined request (Config.PAPERS_PER_REQUEST).
+    
+    Args:
+        filenames: Names of the PDF files
+        pdf_folder: Path to folder containing PDFs
+        ai_client: Initialized AI client
+        model_name: Name of the AI model being used ('claude' or 'openai')
+        cache: Optional response cache checked before calling the AI model
+        rate_limiter: Optional rate limiter acquired before each API request
+        extractor: Executor for PDF extraction (default: the event loop's executor)
+        request_slots: Optional semaphore held only while the AI model is called
+        folder_files: Optional set of file names in pdf_folder, to skip per-file existence checks
+        
+    Returns:
+        List of processing results, one per PDF
+    """
+    loop = asyncio.get_running_loop()
+    results = []
+    found = []
+    for filename in filenames:
+        if pdf_exists(filename, pdf_folder, folder_files):
+            found.append(filename)
+        else:
+            results.append(missing_file_row(filename, pdf_folder))
+    extracted = await asyncio.gather(*[
+        loop.run_in_executor(extractor, extract_info_from_pdf, os.path.join(pdf_folder, filename))
+        for filename in found
+    ])
+    
+    # Cache hits and extraction errors are finished now; the rest share one request. A single-paper
+    # decision (made on the full text) is reused, as is one from an earlier full-size group
+    pending = {}
+    full_group_limit = Config.TOKEN_LIMITS[model_name] // len(filenames)
+    for filename, (pdf_text, title, year, status) in zip(found, extracted):
+        cache_key = response_cache_key(pdf_text, model_name) if pdf_text and cache else None
+        cached_result = None
+        if cache_key:
+            cached_result = (cache.get(cache_key)
+                             or cache.get(response_cache_key(pdf_text, model_name, full_group_limit)))
+        if cached_result or not pdf_text:
+            analysis_result = cached_result or {"decision": "Extraction Error", "justification": status}
+            results.append(result_row(filename, title, year, analysis_result))
+        else:
+            pending[f"paper-{len(pending)}"] = (filename, title, year, pdf_text, cache_key)
+    if not pending:
+        return results
+    
+    decisions = {}
+    per_paper_limit = Config.TOKEN_LIMITS[model_name] // len(pending)
+    if len(pending) > 1:
+        async with request_slots or contextlib.nullcontext():
+            if rate_limiter:
+                await rate_limiter.acquire(sum(estimate_tokens(paper[3], per_paper_limit)
+                                               for paper in pending.values()))
+            decisions = await analyze_texts_packed({paper_id: paper[3] for paper_id, paper in pending.items()},
+                                                   ai_client, model_name)
+    
+    for paper_id, (filename, title, year, pdf_text, cache_key) in pending.items():
+        analysis_result = decisions.get(paper_id)
+        if analysis_result is not None and cache_key:
+            cache_key = response_cache_key(pdf_text, model_name, per_paper_limit)
+        elif analysis_result is None:
+            # Not answered in the combined response: ask about this paper on its own
+            async with request_slots or contextlib.nullcontext():
+                if rate_limiter:
+                    await rate_limiter.acquire(estimate_tokens(pdf_text, Config.TOKEN_LIMITS[model_name]))
+                analysis_result = await analyze_text(pdf_text, ai_client, model_name)
+        if cache_key and analysis_result.get('decision') in ('Include', 'Exclude'):
+            cache.set(cache_key, analysis_result)
+        results.append(result_row(filename, title, year, analysis_result))
+    return results
+
+async def process_files_batch(
+    filenames: List[str],
+    ai_client: Any,
+    model_name: str,
+    cache: Optional[ResponseCache],
+    on_result: Any
+) -> None:
+    """
+    Process PDFs with Batch API jobs (Config.USE_BATCH_API).
+    
+    PDFs left without a result (the job failed, expired or was cancelled) are not
+    recorded, so they are submitted again on the next run.
+    
+    Args:
+        filenames: PDF filenames to process
+        ai_client: Initialized AI client
+        model_name: Name of the AI model being used ('claude' or 'openai')
+        cache: Optional response cache
+        on_result: Called with each result once it is known
+    """
+    loop = asyncio.get_running_loop()
+    to_screen = []
+    folder_files = set(list_folder_files(Config.PDF_FOLDER))
+    found = []
+    for filename in filenames:
+        if pdf_exists(filename, Config.PDF_FOLDER, folder_files):
+            found.append(filename)
+            continue
+        on_result(missing_file_row(filename, Config.PDF_FOLDER))
+    
+    # Extract every PDF up front, EXTRACTION_WORKERS at a time
+    with ThreadPoolExecutor(max_workers=Config.EXTRACTION_WORKERS) as extractor:
+        extractions = [
+            loop.run_in_executor(extractor, extract_info_from_pdf, os.path.join(Config.PDF_FOLDER, f))
+            for f in found
+        ]
+        extracted = [await future for future in tqdm(extractions, desc="Preparing Batch Requests")]
+    
+    for filename, (pdf_text, title, year, status) in zip(found, extracted):
+        cache_key = response_cache_key(pdf_text, model_name) if pdf_text and cache else None
+        cached_result = cache.get(cache_key) if cache_key else None
+        if cached_result or not pdf_text:
+            analysis_result = cached_result or {"decision": "Extraction Error", "justification": status}
+            on_result(result_row(filename, title, year, analysis_result))
+            continue
+        to_screen.append((filename, title, year, pdf_text, cache_key))
+    
+    submit_batch, collect_batch = BATCH_ANALYZERS[model_name]
+    
+    def report(pending: Dict[str, Tuple], results: Dict[str, Dict[str, str]]) -> None:
+        unanswered = 0
+        for request_id, (filename, title, year, pdf_text, cache_key) in pending.items():
+            analysis_result = results.get(request_id)
+            if analysis_result is None:
+                unanswered += 1
+                continue
+            if cache_key and analysis_result.get('decision') in ('Include', 'Exclude'):
+                cache.set(cache_key, analysis_result)
+            on_result(result_row(filename, title, year, analysis_result))
+        if unanswered:
+            print(f"⚠️ {unanswered} PDF(s) got no result from the batch job; they will be retried on the next run")
+    
+    # A batch submitted by an interrupted run is collected rather than paid for twice
+    state = load_batch_state(model_name)
+    if state:
+        request_ids = {filename: request_id for request_id, filename in state['requests'].items()}
+        resumed = {request_ids[paper[0]]: paper for paper in to_screen if paper[0] in request_ids}
+        to_screen = [paper for paper in to_screen if paper[0] not in request_ids]
+        if resumed:
+            print(f"🔁 Resuming batch {state['batch_id']} from an earlier run ({len(resumed)} PDF(s))")
+            report(resumed, await collect_batch(state['batch_id'], ai_client))
+        os.remove(Config.BATCH_STATE_PATH)
+    
+    jobs = split_batch_requests(to_screen, model_name)
+    if len(jobs) > 1:
+        print(f"📦 Splitting {len(to_screen)} PDF(s) into {len(jobs)} batch jobs to stay within the provider limits")
+    for job in jobs:
+        # Batch APIs restrict custom IDs to letters, digits, '-' and '_', so filenames can't be used
+        pending = {f"pdf-{i}": paper for i, paper in enumerate(job)}
+        batch_id = await submit_batch({request_id: paper[3] for request_id, paper in pending.items()}, ai_client)
+        save_batch_state(model_name, batch_id, {request_id: paper[0] for request_id, paper in pending.items()})
+        report(pending, await collect_batch(batch_id, ai_client))
+        os.remove(Config.BATCH_STATE_PATH)
+
+async def process_files(
+    filenames: List[str],
+    ai_client: Any,
+    model_name: str,
+    cache: Optional[ResponseCache],
+    on_result: Any
+) -> None:
+    """
+    Process PDFs concurrently, at most Config.MAX_CONCURRENT_REQUESTS at a time.
+    
+    Args:
+        filenames: PDF filenames to process
+        ai_client: Initialized AI client
+        model_name: Name of the AI model being used
+        cache: Optional response cache
+        on_result: Called with each result as soon as its PDF finishes
+    """
+    request_slots = asyncio.Semaphore(Config.MAX_CONCURRENT_REQUESTS)
+    # PDFs in flight: those calling the model plus those extracted ahead, waiting for a slot
+    in_flight = asyncio.Semaphore(Config.MAX_CONCURRENT_REQUESTS + Config.EXTRACTION_PREFETCH)
+    rate_limiter = RateLimiter(**Config.RATE_LIMITS[model_name])
+    extractor = ThreadPoolExecutor(max_workers=Config.EXTRACTION_WORKERS)
+    folder_files = set(list_folder_files(Config.PDF_FOLDER))
+    
+    papers_per_request = Config.PAPERS_PER_REQUEST if model_name in ('claude', 'openai') else 1
+    if papers_per_request != Config.PAPERS_PER_REQUEST:
+        print(f"⚠️  Combined requests are not available for {model_name.title()}; sending one paper per request")
+    
+    async def bounded(group: List[str]) -> List[Dict[str, str]]:
+        async with in_flight:
+            if len(group) == 1:
+                return [await process_single_pdf(group[0], Config.PDF_FOLDER, ai_client, model_name, cache,
+                                                 rate_limiter, extractor, request_slots, folder_files)]
+            return await process_pdf_group(group, Config.PDF_FOLDER, ai_client, model_name, cache,
+                                           rate_limiter, extractor, request_slots, folder_files)
+    
+    groups = [filenames[i:i + papers_per_request] for i in range(0, len(filenames), papers_per_request)]
+    tasks = [asyncio.create_task(bounded(group)) for group in groups]
+    try:
+        with tqdm(total=len(filenames), desc="Processing PDFs") as progress_bar:
+            for next_results in asyncio.as_completed(tasks):
+                for result in await next_results:
+                    on_result(result)
+                    progress_bar.update(1)
+    finally:
+        for task in tasks:
+            task.cancel()
+        extractor.shutdown(wait=False, cancel_futures=True)
+
+async def run_screening(screening: Any, ai_client: Any) -> None:
+    """
+    Run a screening coroutine, then close the AI client's connection pool.
+    
+    The pool belongs to the event loop that opened its connections, so it is closed
+    on the same loop rather than left to garbage collection.
+    
+    Args:
+        screening: process_files or process_files_batch coroutine
+        ai_client: Initialized AI client
+    """
+    try:
+        await screening
+    finally:
+        # Claude/OpenAI clients own an HTTP pool; the Gemini model has nothing to close
+        close = getattr(ai_client, 'close', None)
+        if close:
+            await close()
 
 def get_user_model_choice():
     """Get AI model choice from user input."""
@@ -669,7 +1579,7 @@ def get_files_list():
         return Config.SPECIFIC_FILES_TO_PROCESS
     else:
         # Get all PDF files from folder
-        all_files = [f for f in os.listdir(Config.PDF_FOLDER) if f.lower().endswith('.pdf')]
+        all_files = [f for f in list_folder_files(Config.PDF_FOLDER) if f.lower().endswith('.pdf')]
         print(f"📄 Processing all {len(all_files)} PDF files in folder")
         return all_files
 
@@ -709,11 +1619,11 @@ def main():
     
     # Load previous progress
     print("📋 Checking for previous progress...")
-    results_list = load_progress()
+    results_list = drop_failed_results(load_progress())
     processed_files = get_processed_filenames(results_list)
     
-    # Filter out already processed files
-    remaining_files = [f for f in files_to_process if f not in processed_files]
+    # Filter out already processed files (and repeats in the file list, which would be sent twice)
+    remaining_files = [f for f in dict.fromkeys(files_to_process) if f not in processed_files]
     
     if processed_files:
         print(f"✅ Found {len(processed_files)} previously processed files")
@@ -724,46 +1634,61 @@ def main():
     if not remaining_files:
         print("🎉 All files have already been processed!")
         # Save final results
-        results_df = pd.DataFrame(results_list)
-        results_df.to_csv(Config.OUTPUT_CSV, index=False, encoding='utf-8')
+        with open(Config.OUTPUT_CSV, 'w', newline='', encoding='utf-8') as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=Config.OUTPUT_COLUMNS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(results_list)
         print(f"📊 Results saved to: {Config.OUTPUT_CSV}")
         return
     
     # Process remaining files
     print(f"\n🚀 Starting analysis with {Config.ANALYSIS_MODEL.title()} model...")
-    print(f"⏱️  Rate limit: {Config.RATE_LIMIT_DELAY} seconds between requests")
+    rate_limits = Config.RATE_LIMITS[Config.ANALYSIS_MODEL]
+    print(f"⏱️  Rate limit: {rate_limits['rpm']} requests / {rate_limits['tpm']:,} tokens per minute, "
+          f"up to {Config.MAX_CONCURRENT_REQUESTS} PDFs at once")
     print("-" * 50)
     
-    for i, filename in enumerate(tqdm(remaining_files, desc="Processing PDFs")):
-        # Process single PDF
-        result = process_single_pdf(filename, Config.PDF_FOLDER, ai_client, Config.ANALYSIS_MODEL)
-        results_list.append(result)
-        
-        # Save progress every 10 files
-        if (i + 1) % 10 == 0:
-            save_progress(results_list)
-            print(f"💾 Progress saved ({len(results_list)} files processed)")
-        
-        # Rate limiting
-        if i < len(remaining_files) - 1:  # Don't sleep after the last file
-            time.sleep(Config.RATE_LIMIT_DELAY)
-    
-    # Save final results
-    print("\n💾 Saving final results...")
-    results_df = pd.DataFrame(results_list)
-    results_df.to_csv(Config.OUTPUT_CSV, index=False, encoding='utf-8')
+    # Rows are written as each PDF finishes (after any resumed ones), so the CSV can be watched
+    # during the run and holds every finished file if the run stops early
+    cache = ResponseCache(Config.RESPONSE_CACHE_PATH) if Config.USE_RESPONSE_CACHE else None
+    progress_writer = ProgressWriter()
+    progress_writer.start()
+    try:
+        with open(Config.OUTPUT_CSV, 'w', newline='', encoding='utf-8') as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=Config.OUTPUT_COLUMNS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(results_list)
+            csv_file.flush()
+            
+            def record_result(result: Dict[str, str]) -> None:
+                results_list.append(result)
+                writer.writerow(result)
+                csv_file.flush()
+                progress_writer.queue.put(result)
+            
+            if Config.USE_BATCH_API and Config.ANALYSIS_MODEL in BATCH_ANALYZERS:
+                screening = process_files_batch(remaining_files, ai_client, Config.ANALYSIS_MODEL, cache,
+                                                record_result)
+            else:
+                if Config.USE_BATCH_API:
+                    print(f"⚠️  Batch mode is not available for {Config.ANALYSIS_MODEL.title()}; sending requests individually")
+                screening = process_files(remaining_files, ai_client, Config.ANALYSIS_MODEL, cache, record_result)
+            asyncio.run(run_screening(screening, ai_client))
+    finally:
+        progress_writer.close()
+        if cache:
+            cache.close()
     
-    # Generate summary statistics
     print("\n📊 ANALYSIS COMPLETE!")
     print("=" * 50)
     print(f"📁 Total files processed: {len(results_list)}")
     print(f"📄 Results saved to: {Config.OUTPUT_CSV}")
     
     # Decision summary
-    decision_counts = results_df['Decision'].value_counts()
+    decision_counts = Counter(result['Decision'] for result in results_list)
     print(f"\n📈 Decision Summary:")
-    for decision, count in decision_counts.items():
-        percentage = (count / len(results_df)) * 100
+    for decision, count in decision_counts.most_common():
+        percentage = (count / len(results_list)) * 100
         print(f"   {decision}: {count} ({percentage:.1f}%)")
     
     # Clean up progress file